@@ -15,6 +15,7 @@ from config import (
 )
 
 from app.models import db
+from app.models.db_instance import json_engine_options
 from app.utils.structured_logging import setup_logging, log_event
 
 # IMPORTS DOS BLUEPRINTS
@@ -129,6 +130,8 @@ def create_app() -> Flask:
         SQLALCHEMY_DATABASE_URI + "?timeout=30&check_same_thread=False"
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = SQLALCHEMY_TRACK_MODIFICATIONS
+    # Serialização das colunas JSON (orjson, se instalado)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = json_engine_options()
 
     # BACKUP CONFIGS
     app.config["BACKUP_RETENTION_MAX_FILES"] = BACKUP_RETENTION_MAX_FILES
@@ -8,8 +8,9 @@ import tarfile
 import mimetypes
 import uuid
 import threading
+from contextlib import contextmanager
 from flask import current_app
-from app.services.progress import update_progress, sync_task_to_db
+from app.services.progress import periodic_db_sync, update_progress, sync_task_to_db
 
 from datetime import datetime
 from sqlalchemy import text, inspect, func
@@ -38,14 +39,39 @@ from app.models import (
     ScheduledRunModel,
     GoogleAuthModel,
 )
-from googleapiclient.discovery import build
+from app.services.Google.drive_tree import build_drive_service
+from app.services.Google.drive_download import TAR_COPY_BUFSIZE
 from googleapiclient.http import MediaIoBaseUpload
 
+# Zstandard (opcional): leitura dos backups .tar.zst
+try:
+    import pyzstd
+except ImportError:  # pragma: no cover - dependência opcional
+    pyzstd = None
+
 admin_bp = Blueprint("admin", __name__)
 
 BACKUP_FOLDER_NAME = "storage/backups"
 
 
+@contextmanager
+def _open_backup_tar(path: str):
+    """
+    Abre um backup TAR para leitura. O tarfile não conhece .tar.zst,
+    então nesse caso o stream é descomprimido pelo pyzstd.
+    """
+    if path.lower().endswith(".zst"):
+        if pyzstd is None:
+            raise RuntimeError("pyzstd não instalado: não é possível ler backups .tar.zst.")
+        with pyzstd.ZstdFile(path, "rb") as zst, tarfile.open(
+            fileobj=zst, mode="r:", copybufsize=TAR_COPY_BUFSIZE
+        ) as tf:
+            yield tf
+    else:
+        with tarfile.open(path, "r:*", copybufsize=TAR_COPY_BUFSIZE) as tf:
+            yield tf
+
+
 def _run_auto_migrations():
     """
     Verifica se o esquema do banco SQLite está atualizado com as novas colunas.
@@ -228,6 +254,7 @@ def _sync_backups_from_disk():
         if not (
             lower.endswith(".zip")
             or lower.endswith(".tar.gz")
+            or lower.endswith(".tar.zst")
             or lower.endswith(".tar")
         ):
             continue
@@ -337,7 +364,7 @@ def _build_archive_tree(archive_path: str):
                         node = children[part]
     else:
         # TAR / TAR.GZ
-        with tarfile.open(archive_path, "r:*") as tf:
+        with _open_backup_tar(archive_path) as tf:
             for member in tf.getmembers():
                 name = member.name or ""
                 if not name:
@@ -578,7 +605,7 @@ def api_backup_download_partial(backup_id):
                     with src_zip.open(info, "r") as src_f:
                         out_zip.writestr(rel_path, src_f.read())
         else:
-            with tarfile.open(backup.path, "r:*") as src_tar:
+            with _open_backup_tar(backup.path) as src_tar:
                 for rel_path in paths:
                     try:
                         member = src_tar.getmember(rel_path)
@@ -627,7 +654,7 @@ def api_backup_restore_drive(backup_id):
     if not isinstance(paths, list) or not paths:
         return jsonify({"ok": False, "error": "Nenhum arquivo selecionado."}), 400
 
-    service = build("drive", "v3", credentials=creds)
+    service = build_drive_service(creds)
 
     # --- pasta raiz "Restaurados" no My Drive ---
     def ensure_root_restore_folder():
@@ -770,7 +797,7 @@ def api_backup_restore_drive(backup_id):
                 )
                 uploaded.append({"path": rel_path, "drive_id": created["id"]})
     else:
-        with tarfile.open(backup.path, "r:*") as src_tar:
+        with _open_backup_tar(backup.path) as src_tar:
             for rel_path in paths:
                 try:
                     member = src_tar.getmember(rel_path)
@@ -954,62 +981,61 @@ def _worker_extract_local(app, task_id, backup_id, target_path, selected_paths):
             # Garante criação da pasta
             StorageService.ensure_dir(target_path)
 
-            # Lógica ZIP
-            if lower.endswith(".zip"):
-                with zipfile.ZipFile(backup.path, "r") as zf:
-                    all_members = zf.namelist()
-                    # Se selected_paths for vazio, pega tudo
-                    to_extract = set(selected_paths) if selected_paths else set(all_members)
-
-                    total_ops = len(to_extract) if selected_paths else len(all_members)
-                    update_progress(task_id, {"files_total": total_ops})
-
-                    for i, member in enumerate(all_members):
-                        # Filtro de seleção
-                        if selected_paths and member not in to_extract:
-                            continue
-
-                        # Segurança básica
-                        if ".." in member: continue
+            # Progresso vai para o banco por uma thread, não a cada N arquivos
+            with periodic_db_sync(task_id):
+                # Lógica ZIP
+                if lower.endswith(".zip"):
+                    with zipfile.ZipFile(backup.path, "r") as zf:
+                        all_members = zf.namelist()
+                        # Se selected_paths for vazio, pega tudo
+                        to_extract = set(selected_paths) if selected_paths else set(all_members)
+
+                        total_ops = len(to_extract) if selected_paths else len(all_members)
+                        update_progress(task_id, {"files_total": total_ops})
+
+                        for i, member in enumerate(all_members):
+                            # Filtro de seleção
+                            if selected_paths and member not in to_extract:
+                                continue
+
+                            # Segurança básica
+                            if ".." in member: continue
+
+                            zf.extract(member, path=target_path)
+                            extracted_count += 1
+
+                            # Só a memória a cada 10 arquivos; o banco fica com o periodic_db_sync
+                            if extracted_count % 10 == 0:
+                                update_progress(task_id, {
+                                    "files_downloaded": extracted_count,
+                                    "message": f"Extraindo: {extracted_count} arquivos..."
+                                })
+
+                # Lógica TAR/GZ
+                else:
+                    with _open_backup_tar(backup.path) as tf:
+                        members = tf.getmembers()
+                        to_extract_list = []
+
+                        if selected_paths:
+                            target_set = set(selected_paths)
+                            to_extract_list = [m for m in members if m.name in target_set]
+                        else:
+                            to_extract_list = members
 
-                        zf.extract(member, path=target_path)
-                        extracted_count += 1
+                        total_ops = len(to_extract_list)
+                        update_progress(task_id, {"files_total": total_ops})
 
-                        # Atualiza progresso a cada 10 arquivos para não sobrecarregar o banco
-                        if extracted_count % 10 == 0:
-                            update_progress(task_id, {
-                                "files_downloaded": extracted_count,
-                                "message": f"Extraindo: {extracted_count} arquivos..."
-                            })
-                            sync_task_to_db(task_id)
+                        for m in to_extract_list:
+                            if m.isdir(): continue
+                            tf.extract(m, path=target_path)
+                            extracted_count += 1
 
-            # Lógica TAR/GZ
-            else:
-                mode = "r:gz" if lower.endswith("gz") else "r:"
-                with tarfile.open(backup.path, mode) as tf:
-                    members = tf.getmembers()
-                    to_extract_list = []
-
-                    if selected_paths:
-                        target_set = set(selected_paths)
-                        to_extract_list = [m for m in members if m.name in target_set]
-                    else:
-                        to_extract_list = members
-
-                    total_ops = len(to_extract_list)
-                    update_progress(task_id, {"files_total": total_ops})
-
-                    for m in to_extract_list:
-                        if m.isdir(): continue
-                        tf.extract(m, path=target_path)
-                        extracted_count += 1
-
-                        if extracted_count % 10 == 0:
-                            update_progress(task_id, {
-                                "files_downloaded": extracted_count,
-                                "message": f"Extraindo: {extracted_count} arquivos..."
-                            })
-                            sync_task_to_db(task_id)
+                            if extracted_count % 10 == 0:
+                                update_progress(task_id, {
+                                    "files_downloaded": extracted_count,
+                                    "message": f"Extraindo: {extracted_count} arquivos..."
+                                })
 
             # Finalização com Sucesso
             update_progress(task_id, {
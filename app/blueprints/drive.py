@@ -114,6 +114,7 @@ def _background_backup_task(
     archive_format,
     filters,
     processing_mode,
+    max_workers=None,
 ):
     with app_context:
         try:
@@ -131,6 +132,7 @@ def _background_backup_task(
                     task_id=task_id,
                     filters=filters,
                     processing_mode=processing_mode,
+                    max_workers=max_workers,
                 )
 
             else:
@@ -145,11 +147,15 @@ def _background_backup_task(
                     task_id=task_id,
                     filters=filters,
                     processing_mode=processing_mode,
+                    max_workers=max_workers,
                 )
 
                 generated_filename = os.path.basename(temp_zip_path)
                 final_dest_path = os.path.join(storage_root_path, generated_filename)
 
+                # Tamanho lido ainda no temp_work (local); o destino pode ser rede
+                size_bytes = os.path.getsize(temp_zip_path)
+
                 # move do tmp para a pasta definitiva de backups
                 shutil.move(temp_zip_path, final_dest_path)
 
@@ -158,8 +164,7 @@ def _background_backup_task(
 
                 # Registra/atualiza o BackupFileModel
                 try:
-                    stat = os.stat(final_dest_path)
-                    size_mb = round(stat.st_size / (1024 * 1024), 2)
+                    size_mb = round(size_bytes / (1024 * 1024), 2)
                     items_count = PROGRESS.get(task_id, {}).get("files_total", 0)
 
                     existing = BackupFileModel.query.filter_by(
@@ -418,6 +423,8 @@ def download():
 
     execution_mode = data.get("execution_mode") or "immediate"
     processing_mode = data.get("processing_mode") or "sequential"
+    # Opcional: teto de downloads simultâneos (vazio = DOWNLOAD_MAX_WORKERS)
+    max_workers = _parse_positive_int(data.get("max_workers"))
 
     # Caminho físico onde os backups são armazenados
     storage_root_path = StorageService.backups_dir()
@@ -440,6 +447,7 @@ def download():
             archive_format,
             build_filters_from_form(data),
             processing_mode,
+            max_workers,
         ),
         daemon=True,
     )
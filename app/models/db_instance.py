@@ -4,10 +4,28 @@ from sqlalchemy import event
 from sqlalchemy.engine import Engine
 import sqlite3
 
+try:
+    import orjson
+except ImportError:  # opcional: sem ele fica o json da stdlib
+    orjson = None
+
 # Instância global do SQLAlchemy
 db = SQLAlchemy()
 
 
+def json_engine_options() -> dict:
+    """
+    Opções de engine para as colunas db.JSON (histórico das tarefas, cache de
+    estrutura etc.) usarem o orjson quando ele estiver instalado.
+    """
+    if orjson is None:
+        return {}
+    return {
+        "json_serializer": lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode(),
+        "json_deserializer": orjson.loads,
+    }
+
+
 # Quando conectar no SQLite, aplica otimizações seguras
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
@@ -1,10 +1,18 @@
 # services/drive_filters.py
+import functools
 import re
 from datetime import datetime, timezone
 
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|]')
+
+
+@functools.lru_cache(maxsize=65536)
 def safe_name(name: str) -> str:
     """Remove caracteres problemáticos para uso em caminhos/arquivos."""
-    return re.sub(r'[\\/:*?"<>|]', "_", name)
+    # Caminho rápido: a maioria dos nomes já é segura, evita alocar outra string
+    if _UNSAFE_CHARS.search(name) is None:
+        return name
+    return _UNSAFE_CHARS.sub("_", name)
 
 
 def classify_mime(mime: str) -> str:
@@ -63,6 +71,27 @@ def extract_size_bytes(meta: dict) -> int:
         return 0
 
 
+# Grupos de tipo do formulário; todos marcados = sem filtro de tipo
+FILTER_GROUPS = frozenset({"pdf", "docs", "sheets", "images", "videos", "others"})
+
+
+def active_filters(filters: dict | None) -> dict | None:
+    """
+    Retorna os filtros só se algum deles restringir de fato; senão None.
+    Os loops de mapeamento chamam isso uma vez e pulam o file_passes_filters
+    por arquivo quando não há nada para filtrar.
+    """
+    if not filters:
+        return None
+    groups = filters.get("groups")
+    if groups and not FILTER_GROUPS <= set(groups):
+        return filters
+    if (filters.get("created_after") or filters.get("modified_after")
+            or filters.get("max_size_bytes") is not None):
+        return filters
+    return None
+
+
 def file_passes_filters(meta: dict, filters: dict | None) -> bool:
     """Aplica filtros de tipo, data e tamanho em um arquivo do Drive."""
     if not filters:
@@ -130,7 +159,7 @@ def build_filters_from_form(form) -> dict:
 
     # Se nenhum tipo marcado, considera todos
     if not groups:
-        groups = {"pdf", "docs", "sheets", "images", "videos", "others"}
+        groups = set(FILTER_GROUPS)
 
     created_after = parse_date_input(form.get("created_after"))
     modified_after = parse_date_input(form.get("modified_after"))
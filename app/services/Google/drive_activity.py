@@ -23,7 +23,7 @@ def fetch_activity_log(creds, item_id):
     Retorna lista simplificada: [{date, action, actor}, ...]
     """
     try:
-        service = build('driveactivity', 'v2', credentials=creds, cache_discovery=False)
+        service = build('driveactivity', 'v2', credentials=creds, cache_discovery=False, static_discovery=True)
         
         # O nome do item deve ser 'items/ID'
         item_name = f"items/{item_id}"
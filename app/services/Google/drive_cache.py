@@ -1,4 +1,5 @@
 # app/services/Google/drive_cache.py
+from collections import deque
 from datetime import datetime, timedelta
 
 from flask import current_app
@@ -176,10 +177,10 @@ def rebuild_full_cache(creds, include_files: bool = True) -> int:
     total = 0
 
     # BFS simples usando get_children()
-    queue = [("root", root.path or "Meu Drive")]
+    queue = deque([("root", root.path or "Meu Drive")])
 
     while queue:
-        folder_id, folder_path = queue.pop(0)
+        folder_id, folder_path = queue.popleft()
         children = get_children(creds, folder_id, include_files=True)
         seen_at = datetime.utcnow()
 
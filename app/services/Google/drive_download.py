@@ -1,42 +1,196 @@
 # services/drive_download_service.py
 import errno
+import functools
+import gzip
+import itertools
 import os
 import io
 import stat
+import subprocess
 import time
 import shutil
 import tempfile
 import zipfile
 import tarfile
 import threading
+import weakref
 import concurrent.futures
+from collections import deque
 import random
 import queue
 import re  # Essencial para a limpeza de nomes
+import zlib
 
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from google.oauth2.credentials import Credentials
 from googleapiclient.errors import HttpError
 
-from .drive_tree import build_files_list_for_items, get_children
-from .drive import file_passes_filters
-from app.services.progress import sync_task_to_db, update_progress
+# ISA-L (opcional): DEFLATE com SIMD, bem mais rápido que o zlib padrão
+try:
+    from isal import isal_zlib, igzip
+except ImportError:  # pragma: no cover - dependência opcional
+    isal_zlib = None
+    igzip = None
+
+# Zstandard (opcional): habilita o formato "tar.zst", multi-thread no próprio compressor
+try:
+    import pyzstd
+except ImportError:  # pragma: no cover - dependência opcional
+    pyzstd = None
+
+from config import DOWNLOAD_MAX_WORKERS
+
+from .drive_tree import (
+    FOLDERS_PER_LIST_QUERY,
+    build_drive_service,
+    build_files_list_for_items,
+    creds_key,
+    get_children_many,
+    get_files_metadata_many,
+    http_error_reason,
+    is_rate_limit_error,
+    mark_rate_limited,
+    wait_rate_limit_cooldown,
+)
+from .drive import active_filters, file_passes_filters
+from app.services.progress import (
+    TaskCancelled,
+    get_task_events,
+    periodic_db_sync,
+    sync_task_to_db,
+    update_progress,
+)
 from app.services.storage import StorageService
 
-_dl_lock = threading.Lock()
+# Reserva de nomes (used_rel_paths) com locks por pasta: colisões só
+# acontecem dentro da mesma pasta, então pastas diferentes não disputam
+_PATH_LOCK_SHARDS = 32
+_path_locks = [threading.Lock() for _ in range(_PATH_LOCK_SHARDS)]
+_task_locks = weakref.WeakValueDictionary()
+_task_locks_guard = threading.Lock()
 _archive_lock = threading.Lock()
 _thread_local = threading.local()
+# Services (cada um com sua conexão HTTPS) reaproveitados entre as threads de
+# download, por conta (creds_key). Não dá para usar o objeto Credentials como
+# chave fraca: o AuthorizedHttp de cada service guarda uma referência forte a
+# ele, e a entrada (com os sockets) nunca sairia do dict.
+_service_pool: dict = {}
+_service_pool_lock = threading.Lock()
+
+# Só usado onde não há os.pwrite (Windows)
+_range_write_lock = threading.Lock()
+# Memória em uso por downloads médios que vão direto para o pacote
+_stream_budget_lock = threading.Lock()
+_stream_budget_used = 0
 
 # Configurações
-MAX_DOWNLOAD_WORKERS = 150
+MAX_DOWNLOAD_WORKERS = DOWNLOAD_MAX_WORKERS
 MAX_ARCHIVE_WORKERS = os.cpu_count() + 4
-CHUNK_SIZE = 50 * 1024 * 1024
+# Services ociosos guardados por conta (um por worker de download basta)
+SERVICE_POOL_MAX_PER_CREDS = MAX_DOWNLOAD_WORKERS
+# Tamanho do chunk do MediaIoBaseDownload, ajustado por thread conforme a
+# vazão observada: conexões rápidas sobem até o máximo, lentas descem até o
+# mínimo (menos RAM parada por worker e pausa/cancelamento mais responsivos)
+CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE_MIN = 1 * 1024 * 1024
+CHUNK_SIZE_MAX = 64 * 1024 * 1024
+CHUNK_FAST_RATE = 50 * 1024 * 1024  # bytes/s
+CHUNK_SLOW_RATE = 2 * 1024 * 1024  # bytes/s
 RETRY_LIMIT = 10
+BACKOFF_MAX_SECONDS = 64
 MEMORY_BUFFER_LIMIT = 100 * 1024 * 1024
+TAR_COPY_BUFSIZE = 16 * 1024 * 1024
+# Arquivos até esse tamanho (e exportações do Google Docs) vão direto da
+# memória para o ZIP/TAR no modo pacote, sem passar pela pasta temporária
+STREAM_TO_ARCHIVE_LIMIT = 8 * 1024 * 1024
+# Arquivos médios (até STREAM_TO_ARCHIVE_MAX) também vão direto, enquanto
+# couberem no orçamento de memória; senão caem no caminho pelo disco
+STREAM_TO_ARCHIVE_MAX = 64 * 1024 * 1024
+STREAM_TO_ARCHIVE_BUDGET = 512 * 1024 * 1024
+# Arquivos binários a partir desse tamanho são baixados em faixas (HTTP Range)
+# simultâneas, cada uma em uma conexão do pool, gravadas direto na posição final
+# (só quando o limitador adaptativo tem vagas livres para as faixas extras)
+RANGE_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+# Faixa do tamanho do chunk padrão: em memória, cada faixa pesa o mesmo que
+# um worker sequencial, e cada uma ocupa uma vaga do limitador
+RANGE_SLICE_SIZE = CHUNK_SIZE
+RANGE_PARALLEL = 4
+# Espelho: arquivos grandes já gravados saem do page cache (ninguém vai relê-los)
+MIRROR_DROP_CACHE_MIN = 64 * 1024 * 1024
+# tar.gz em blocos independentes (estilo pigz), comprimidos em paralelo
+GZIP_BLOCK_SIZE = 2 * 1024 * 1024
+
+# Intervalo da thread que grava o progresso no banco durante os jobs
+DB_SYNC_INTERVAL = 2.0  # segundos
+
+# Itens em espera por worker: futures vivos no download sequencial (janela
+# deslizante) e tamanho da fila mapeador -> workers no modo concorrente
+SUBMIT_WINDOW_FACTOR = 4
+
+# Listagens de pasta simultâneas no mapeador do modo concorrente
+MAPPER_LIST_WORKERS = 8
+
+# Concorrência adaptativa (AIMD) dos downloads: começa baixo, sobe a cada
+# intervalo sem rate limit e cai pela metade quando o Drive responde 429/503
+ADAPTIVE_START_WORKERS = 8
+ADAPTIVE_STEP = 2
+ADAPTIVE_INTERVAL = 1.0  # segundos
+ADAPTIVE_MIN_WORKERS = 2
+# Depois de um rate limit, só volta a crescer após esse tempo sem novos 429/503
+ADAPTIVE_QUIET_PERIOD = 10.0  # segundos
+
+# compression_level -> (nível zlib 0-9, nível ISA-L 0-3)
+# "normal" usa nível 3: o conteúdo típico do Drive já vem comprimido e o
+# nível 6 gasta bem mais CPU para ganhar menos de 1% de tamanho
+_COMPRESSION_LEVELS = {"fast": (1, 1), "max": (9, 3)}
+_DEFAULT_COMPRESSION_LEVEL = (3, 1)
+# Níveis do Zstandard para o tar.zst
+_ZSTD_LEVELS = {"fast": 1, "max": 19}
+_DEFAULT_ZSTD_LEVEL = 3
+
+_crc32 = isal_zlib.crc32 if isal_zlib is not None else zlib.crc32
+
+
+def _deflate_compressor(compresslevel=None):
+    """
+    Compressor DEFLATE cru (wbits -15, o formato dos membros do ZIP). Usa o
+    ISA-L quando instalado; a saída continua sendo DEFLATE padrão.
+    compresslevel vem na escala do zlib (0-9), como no ZipFile.
+    """
+    if isal_zlib is not None:
+        if compresslevel is None:
+            level = _DEFAULT_COMPRESSION_LEVEL[1]
+        else:
+            # Converte a escala do zlib (0-9) para a do ISA-L (0-3)
+            level = min((compresslevel + 2) // 3, 3)
+        return isal_zlib.compressobj(level, isal_zlib.DEFLATED, -15)
+    if compresslevel is None:
+        compresslevel = _DEFAULT_COMPRESSION_LEVEL[0]
+    return zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+
+
+class _BundleZipFile(zipfile.ZipFile):
+    """
+    ZipFile do pacote de backup: membros DEFLATE gravados pelo próprio
+    zipfile (open/write/writestr) usam o ISA-L. Fica restrito a este objeto,
+    sem mexer no módulo zipfile (os outros ZIPs do processo não mudam).
+    """
+
+    def open(self, name, mode="r", pwd=None, *, force_zip64=False):
+        dest = super().open(name, mode, pwd, force_zip64=force_zip64)
+        if (mode == "w" and isal_zlib is not None
+                and getattr(dest, "_compressor", None) is not None
+                and getattr(getattr(dest, "_zinfo", None), "compress_type", None) == zipfile.ZIP_DEFLATED):
+            # Nada foi comprimido ainda: só troca o compressor do membro
+            dest._compressor = _deflate_compressor(self.compresslevel)
+        return dest
+
+
+_UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*]')
 
 
 # --- FUNÇÃO DE LIMPEZA CRÍTICA PARA CORRIGIR WINERROR 3 ---
+@functools.lru_cache(maxsize=65536)
 def safe_name(name):
     """
     Higieniza nomes para Windows.
@@ -47,8 +201,13 @@ def safe_name(name):
     if not name:
         return "sem_nome"
 
+    # Caminho rápido: nome já seguro (caso mais comum) volta sem alocar nada
+    if (_UNSAFE_CHARS.search(name) is None and name.isprintable()
+            and name == name.strip() and not name.endswith(".")):
+        return name
+
     # Substitui caracteres proibidos por underscore
-    name = re.sub(r'[<>:"/\\|?*]', '_', name)
+    name = _UNSAFE_CHARS.sub("_", name)
 
     # Remove caracteres não printáveis
     name = "".join(c for c in name if c.isprintable())
@@ -61,23 +220,130 @@ def safe_name(name):
     return name
 
 
+def _task_lock(task_id):
+    """Lock do progresso de uma tarefa: jobs simultâneos não disputam o mesmo lock."""
+    with _task_locks_guard:
+        lock = _task_locks.get(task_id)
+        if lock is None:
+            lock = threading.Lock()
+            _task_locks[task_id] = lock
+        return lock
+
+
+class _AdaptiveLimiter:
+    """
+    Limita quantos downloads rodam ao mesmo tempo em um job (AIMD, como no TCP).
+    O pool continua com MAX_DOWNLOAD_WORKERS threads; as que passam do limite
+    atual ficam paradas em acquire() até o limite subir ou uma vaga abrir.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = max(1, maximum)
+        self.limit = min(ADAPTIVE_START_WORKERS, self.maximum)
+        self.active = 0
+        self._cond = threading.Condition()
+        self._last_change = time.monotonic()
+        self._last_throttle = float("-inf")
+        self._last_cut = float("-inf")
+
+    def _maybe_grow(self):
+        now = time.monotonic()
+        if (self.limit < self.maximum
+                and now - self._last_change >= ADAPTIVE_INTERVAL
+                and now - self._last_throttle >= ADAPTIVE_QUIET_PERIOD):
+            self.limit = min(self.maximum, self.limit + ADAPTIVE_STEP)
+            self._last_change = now
+            self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            self._maybe_grow()
+            while self.active >= self.limit:
+                self._cond.wait(ADAPTIVE_INTERVAL)
+                self._maybe_grow()
+            self.active += 1
+
+    def try_acquire(self, count: int) -> int:
+        """Pega até `count` vagas livres agora, sem esperar. Retorna quantas pegou."""
+        with self._cond:
+            self._maybe_grow()
+            taken = max(0, min(count, self.limit - self.active))
+            self.active += taken
+            return taken
+
+    def release(self, count: int = 1):
+        if not count:
+            return
+        with self._cond:
+            self.active -= count
+            self._maybe_grow()
+            self._cond.notify(count)
+
+    def on_throttle(self):
+        """
+        Rate limit do Drive: corta o limite pela metade. Vários workers batem no
+        mesmo 429 de uma vez, então corta no máximo uma vez por intervalo.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_cut >= ADAPTIVE_INTERVAL:
+                self.limit = max(min(ADAPTIVE_MIN_WORKERS, self.maximum), self.limit // 2)
+                self._last_change = self._last_cut = now
+            self._last_throttle = now
+
+
 def get_thread_safe_service(creds):
-    if not hasattr(_thread_local, "service"):
-        _thread_local.service = build("drive", "v3", credentials=creds, cache_discovery=False)
+    # Um service por thread, montado com o discovery embutido na lib (sem rede).
+    # Refeito só se a thread for reaproveitada com outras credenciais.
+    if getattr(_thread_local, "creds", None) is not creds:
+        _thread_local.service = build_drive_service(creds)
+        _thread_local.creds = creds
     return _thread_local.service
 
 
+def _checkout_service(creds):
+    """
+    Pega um service livre do pool das credenciais (ou monta um novo).
+    O httplib2 não é thread-safe, então cada service fica com uma thread só
+    enquanto estiver emprestado; mas as conexões abertas passam de uma thread
+    para outra, em vez de cada thread do pool fazer o próprio handshake TLS.
+    Sem refresh token não há chave estável da conta: nada é reaproveitado.
+    """
+    if not getattr(creds, "refresh_token", None):
+        return build_drive_service(creds)
+    with _service_pool_lock:
+        free = _service_pool.get(creds_key(creds))
+        if free:
+            return free.pop()
+    return build_drive_service(creds)
+
+
+def _checkin_service(creds, service):
+    # O pool não se esvazia sozinho: acima do teto da conta, o service
+    # devolvido é fechado em vez de guardado
+    if getattr(creds, "refresh_token", None):
+        with _service_pool_lock:
+            free = _service_pool.setdefault(creds_key(creds), [])
+            if len(free) < SERVICE_POOL_MAX_PER_CREDS:
+                free.append(service)
+                return
+    close = getattr(service, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
 def check_status_pause_cancel(progress_dict, task_id):
     if not progress_dict or not task_id:
         return
-    while True:
-        info = progress_dict.get(task_id, {})
-        if info.get("canceled"):
-            raise Exception("Cancelado pelo usuário")
-        if info.get("paused"):
-            time.sleep(1)
-            continue
-        break
+    # Eventos da tarefa: pausa bloqueia sem polling e retoma na hora
+    cancel_event, run_event = get_task_events(task_id)
+    if not run_event.is_set():
+        run_event.wait()
+    if cancel_event.is_set():
+        raise TaskCancelled()
 
 
 def format_size(size_bytes):
@@ -89,25 +355,186 @@ def format_size(size_bytes):
     return f"{size_bytes:.1f} PB"
 
 
+# Google Apps -> (MIME de exportação, extensão do arquivo gerado)
+_EXPORT_MAP = {
+    "application/vnd.google-apps.document": (
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document", ".docx"),
+    "application/vnd.google-apps.spreadsheet": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+    "application/vnd.google-apps.presentation": (
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation", ".pptx"),
+    "application/vnd.google-apps.drawing": ("image/png", ".png"),
+}
+
+
 def get_export_info(mime_type: str, file_name: str):
-    if not mime_type: return (None, None)
-    if mime_type == "application/vnd.google-apps.document":
-        return ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                file_name if file_name.lower().endswith(".docx") else file_name + ".docx")
-    if mime_type == "application/vnd.google-apps.spreadsheet":
-        return ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                file_name if file_name.lower().endswith(".xlsx") else file_name + ".xlsx")
-    if mime_type == "application/vnd.google-apps.presentation":
-        return ("application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                file_name if file_name.lower().endswith(".pptx") else file_name + ".pptx")
-    if mime_type == "application/vnd.google-apps.drawing":
-        return ("image/png",
-                file_name if file_name.lower().endswith(".png") else file_name + ".png")
-    return (None, None)
-
-
-def _worker_download_one(creds, f_info, dest_root, used_rel_paths, progress_dict, task_id, filters):
-    service = get_thread_safe_service(creds)
+    pair = _EXPORT_MAP.get(mime_type)
+    if not pair: return (None, None)
+    export_mime, ext = pair
+    if file_name[-len(ext):].lower() != ext:
+        file_name = file_name + ext
+    return (export_mime, file_name)
+
+
+def _backoff_seconds(retry_count: int) -> float:
+    """Backoff exponencial com teto e jitter, para os workers não voltarem todos juntos."""
+    base = min(BACKOFF_MAX_SECONDS, 2 ** retry_count)
+    return base + random.uniform(0, base / 2)
+
+
+def _adapt_chunk_size(nbytes: int, elapsed: float):
+    """
+    Dobra/corta pela metade o chunk desta thread conforme a vazão do último
+    next_chunk. Vale a partir do próximo MediaIoBaseDownload criado na thread.
+    """
+    if nbytes <= 0 or elapsed <= 0:
+        return
+    size = getattr(_thread_local, "chunk_size", CHUNK_SIZE)
+    rate = nbytes / elapsed
+    if rate > CHUNK_FAST_RATE and nbytes >= size:
+        size = min(CHUNK_SIZE_MAX, size * 2)
+    elif rate < CHUNK_SLOW_RATE:
+        size = max(CHUNK_SIZE_MIN, size // 2)
+    else:
+        return
+    _thread_local.chunk_size = size
+
+
+def _open_download_sink(local_path, size_hint: int = 0):
+    """
+    Abre o arquivo de destino de um download.
+
+    io.FileIO não tem buffer em user-space: cada chunk entregue pelo
+    MediaIoBaseDownload (CHUNK_SIZE) vira um único write() no kernel, então
+    o custo de syscalls por arquivo já é mínimo. Centralizado aqui para que
+    toda a escrita local passe por um único ponto.
+
+    Quando o tamanho é conhecido (arquivos binários), reserva o espaço de uma
+    vez com posix_fallocate: o sistema de arquivos aloca extents contíguos em
+    vez de crescer o arquivo a cada chunk, com muitos downloads gravando juntos.
+    """
+    fh = io.FileIO(local_path, "wb")
+    if size_hint > 0:
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fh.fileno(), 0, size_hint)
+            elif os.name == "nt":
+                # NTFS: estender o arquivo já reserva os clusters; como a escrita é
+                # sequencial a partir do 0, não há custo de preencher com zeros
+                fh.truncate(size_hint)
+        except OSError:
+            pass  # FS sem suporte: segue com a escrita normal
+    return fh
+
+
+def _write_at(fd: int, data: bytes, offset: int):
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        # Windows: sem pwrite; lseek + write precisam ser atômicos entre as threads
+        with _range_write_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+
+def _download_range_slice(creds, file_id, fd, lo, hi, size, limiter, progress_dict, task_id) -> bool:
+    """
+    Baixa bytes lo..hi (inclusive) com Range e grava na mesma posição do arquivo.
+    Retorna False se o servidor ignorou o Range e mandou o arquivo inteiro
+    (o corpo já recebido é gravado e o download termina ali).
+    """
+    service = _checkout_service(creds)
+    try:
+        retry_count = 0
+        while True:
+            check_status_pause_cancel(progress_dict, task_id)
+            wait_rate_limit_cooldown()
+            # Request público do googleapiclient com o cabeçalho Range (o mesmo
+            # que o MediaIoBaseDownload usa); 206 e 200 voltam como o corpo cru
+            req = service.files().get_media(fileId=file_id)
+            req.headers["range"] = f"bytes={lo}-{hi}"
+            try:
+                content = req.execute()
+            except HttpError as err:
+                rate_limited = is_rate_limit_error(err)
+                if not (rate_limited or err.resp.status in (500, 502, 503)):
+                    # 403 de permissão/abuso etc.: o chamador volta para o sequencial
+                    raise
+                if limiter is not None:
+                    limiter.on_throttle()
+                retry_count += 1
+                if retry_count > RETRY_LIMIT:
+                    raise
+                sleep_s = _backoff_seconds(retry_count)
+                if rate_limited:
+                    mark_rate_limited(sleep_s)
+                time.sleep(sleep_s)
+                continue
+
+            if len(content) == hi - lo + 1:
+                _write_at(fd, content, lo)
+                return True
+            if lo == 0 and len(content) == size:
+                # Range ignorado (200): o arquivo inteiro já chegou, aproveita
+                _write_at(fd, content, 0)
+                return False
+            raise IOError(f"Faixa {lo}-{hi} veio com {len(content)} bytes")
+    finally:
+        _checkin_service(creds, service)
+
+
+def _download_ranges(creds, file_id, fh, size, limiter, progress_dict, task_id) -> bool:
+    """
+    Download de arquivo grande em faixas de RANGE_SLICE_SIZE, gravadas com
+    pwrite no arquivo já pré-alocado (a ordem de chegada não importa).
+
+    Cada faixa extra em paralelo ocupa uma vaga do _AdaptiveLimiter, além da
+    que o worker já tem: só entra se houver vaga livre agora (sem esperar, para
+    workers segurando uma vaga não travarem uns aos outros). Sem vaga sobrando,
+    retorna False e o chamador baixa pelo caminho sequencial.
+    """
+    if limiter is None:
+        return False
+    extra = limiter.try_acquire(RANGE_PARALLEL - 1)
+    if not extra:
+        return False
+    try:
+        fd = fh.fileno()
+        ranges = [(lo, min(lo + RANGE_SLICE_SIZE, size) - 1) for lo in range(0, size, RANGE_SLICE_SIZE)]
+
+        # A primeira faixa vai sozinha: se o servidor ignorar o Range, o
+        # arquivo chega uma vez só (e já fica gravado), não uma por faixa
+        lo, hi = ranges[0]
+        if _download_range_slice(creds, file_id, fd, lo, hi, size, limiter, progress_dict, task_id):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1 + extra) as executor:
+                futures = [
+                    executor.submit(_download_range_slice, creds, file_id, fd, lo, hi, size,
+                                    limiter, progress_dict, task_id)
+                    for lo, hi in ranges[1:]
+                ]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        fh.seek(size)
+        return True
+    finally:
+        limiter.release(extra)
+
+
+def _worker_download_one(creds, f_info, dest_root, used_rel_paths, known_dirs, progress_dict, task_id, filters,
+                         limiter=None, archive=None, service=None, on_downloaded=None):
+    if service is None:
+        service = get_thread_safe_service(creds)
     file_id = f_info["id"]
     mime = f_info.get("mimeType") or ""
     original_name = f_info.get("name") or "arquivo"
@@ -137,8 +564,11 @@ def _worker_download_one(creds, f_info, dest_root, used_rel_paths, progress_dict
     # Tratamento de Atalhos
     if mime == "application/vnd.google-apps.shortcut":
         try:
-            sc_meta = service.files().get(fileId=file_id, fields="shortcutDetails").execute()
-            target = sc_meta.get("shortcutDetails", {}).get("targetId")
+            # O alvo normalmente já veio no files().list do mapeamento
+            target = f_info.get("shortcutTargetId")
+            if not target:
+                sc_meta = service.files().get(fileId=file_id, fields="shortcutDetails").execute()
+                target = sc_meta.get("shortcutDetails", {}).get("targetId")
             if target:
                 meta = service.files().get(fileId=target, fields="id,name,mimeType,size").execute()
                 file_id = meta["id"]
@@ -174,92 +604,174 @@ def _worker_download_one(creds, f_info, dest_root, used_rel_paths, progress_dict
         else:
             request_dl = service.files().get_media(fileId=file_id)
     except Exception as e:
-        with _dl_lock:
-             if progress_dict and task_id:
-                info = progress_dict[task_id]
-                hist = info.get("history", [])
-                hist.append(f"FALHA Meta {download_name}: {str(e)}")
-                info["history"] = hist
+        # O histórico é um deque: append é atômico, não precisa do lock da tarefa
+        if progress_dict and task_id:
+            progress_dict[task_id]["history"].append(f"FALHA Meta {download_name}: {str(e)}")
         return
 
     # Garante que não sobrescreve arquivos com mesmo nome na mesma pasta
-    with _dl_lock:
-        # Separa pasta e arquivo do caminho JÁ SANITIZADO
-        dir_part = os.path.dirname(sanitized_rel_path)
-        base_part = os.path.basename(sanitized_rel_path)
-
-        candidate_rel = sanitized_rel_path
-        root, ext = os.path.splitext(base_part)
+    # used_rel_paths: caminho reservado -> próximo sufixo " (n)" a tentar, para
+    # não refazer a varredura desde (1) a cada nome repetido na mesma pasta
+    dir_part = os.path.dirname(sanitized_rel_path)
+    with _path_locks[hash(dir_part) % _PATH_LOCK_SHARDS]:
+        counter = used_rel_paths.get(sanitized_rel_path)
+        if counter is None:
+            candidate_rel = sanitized_rel_path
+        else:
+            # Separa pasta e arquivo do caminho JÁ SANITIZADO
+            root, ext = os.path.splitext(os.path.basename(sanitized_rel_path))
 
-        counter = 1
-        while candidate_rel in used_rel_paths:
-            new_base = f"{root} ({counter}){ext}"
-            candidate_rel = os.path.join(dir_part, new_base)
-            counter += 1
+            candidate_rel = os.path.join(dir_part, f"{root} ({counter}){ext}")
+            while candidate_rel in used_rel_paths:
+                counter += 1
+                candidate_rel = os.path.join(dir_part, f"{root} ({counter}){ext}")
+            used_rel_paths[sanitized_rel_path] = counter + 1
 
-        used_rel_paths.add(candidate_rel)
+        used_rel_paths[candidate_rel] = 1
         final_rel_path = candidate_rel
 
-    # Caminho absoluto no disco local
-    raw_local_path = os.path.join(dest_root, final_rel_path)
-    local_path = StorageService.prepare_long_path(raw_local_path)
+    # Modo pacote: arquivos pequenos/exportações vão da memória direto para o
+    # ZIP/TAR (archive = (archive_obj, archive_format)), sem gravar e reler do disco
+    stream_to_archive = archive is not None and (
+        bool(export_mime) or file_size_bytes <= STREAM_TO_ARCHIVE_LIMIT
+    )
+    stream_budget = 0
+    if (archive is not None and not stream_to_archive
+            and file_size_bytes <= STREAM_TO_ARCHIVE_MAX
+            and _reserve_stream_budget(file_size_bytes)):
+        stream_to_archive = True
+        stream_budget = file_size_bytes
+
+    if stream_to_archive:
+        local_path = None
+        fh = io.BytesIO()
+    else:
+        # Caminho absoluto no disco local
+        # (dest_root já chega com o prefixo de caminho longo aplicado pelo chamador)
+        local_path = os.path.join(dest_root, final_rel_path)
 
-    # Cria a pasta pai (Isso previne o WinError 3)
-    dir_name = os.path.dirname(local_path)
-    StorageService.ensure_dir(dir_name)
+        # Cria a pasta pai (Isso previne o WinError 3)
+        dir_name = os.path.dirname(local_path)
+        StorageService.ensure_dir_cached(dir_name, known_dirs)
 
-    fh = io.FileIO(local_path, "wb")
+        fh = _open_download_sink(local_path, 0 if export_mime else file_size_bytes)
     try:
-        downloader = MediaIoBaseDownload(fh, request_dl, chunksize=CHUNK_SIZE)
         done = False
+        if local_path and not export_mime and file_size_bytes >= RANGE_DOWNLOAD_THRESHOLD:
+            try:
+                done = _download_ranges(creds, file_id, fh, file_size_bytes, limiter, progress_dict, task_id)
+            except TaskCancelled:
+                raise
+            except Exception:
+                # Faixas falharam: refaz do início pelo caminho sequencial
+                fh.seek(0)
+
+        downloader = MediaIoBaseDownload(
+            fh, request_dl, chunksize=getattr(_thread_local, "chunk_size", CHUNK_SIZE)
+        )
         retry_count = 0
+        abuse_acknowledged = False
+        # Bytes já baixados segundo o último status (MediaDownloadProgress)
+        progress_seen = 0
         while not done:
             check_status_pause_cancel(progress_dict, task_id)
+            wait_rate_limit_cooldown()
             try:
+                started = time.monotonic()
                 status, done = downloader.next_chunk()
                 retry_count = 0
+                if status is not None:
+                    _adapt_chunk_size(status.resumable_progress - progress_seen, time.monotonic() - started)
+                    progress_seen = status.resumable_progress
             except HttpError as err:
+                if (err.resp.status == 403 and not export_mime and not abuse_acknowledged
+                        and http_error_reason(err) == "cannotDownloadAbusiveFile"):
+                    # Arquivo sinalizado pelo Drive: esse 403 nunca muda com backoff,
+                    # então refaz o pedido confirmando o aviso (acknowledgeAbuse)
+                    request_dl = service.files().get_media(fileId=file_id, acknowledgeAbuse=True)
+                    fh.seek(0)
+                    fh.truncate()
+                    downloader = MediaIoBaseDownload(
+                        fh, request_dl, chunksize=getattr(_thread_local, "chunk_size", CHUNK_SIZE)
+                    )
+                    abuse_acknowledged = True
+                    progress_seen = 0
+                    continue
                 if err.resp.status in [403, 429, 500, 502, 503]:
+                    rate_limited = is_rate_limit_error(err)
+                    if err.resp.status == 403 and not rate_limited:
+                        # Sem permissão/limite de cota diária: backoff não resolve
+                        raise err
+                    if limiter is not None and (rate_limited or err.resp.status == 503):
+                        limiter.on_throttle()
                     retry_count += 1
                     if retry_count > RETRY_LIMIT: raise err
-                    sleep_s = (2 ** retry_count) + random.uniform(0, 1)
+                    sleep_s = _backoff_seconds(retry_count)
+                    if rate_limited:
+                        mark_rate_limited(sleep_s)
                     time.sleep(sleep_s)
                     continue
                 else:
                     raise err
+            except TaskCancelled:
+                raise
             except Exception as e:
-                if "Cancelado" in str(e): raise e
                 retry_count += 1
                 if retry_count > RETRY_LIMIT: raise e
                 time.sleep(2)
                 continue
+
+        # Descarta o que sobrou da reserva caso o tamanho informado pelo Drive divirja
+        fh.truncate()
+
+        if (local_path and archive is None and file_size_bytes >= MIRROR_DROP_CACHE_MIN
+                and hasattr(os, "posix_fadvise")):
+            # No Linux o DONTNEED já dispara o writeback e libera as páginas,
+            # em vez de um espelho grande empurrar o resto do cache para fora
+            try:
+                os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+
+        if stream_to_archive:
+            archive_obj, archive_format = archive
+            _archive_bytes(
+                archive_obj, archive_format, final_rel_path.replace(os.sep, "/"),
+                fh.getvalue(), f_info.get("mimeType"),
+            )
     except Exception as e:
         if not fh.closed: fh.close()
-        if os.path.exists(local_path):
+        if local_path and os.path.exists(local_path):
             try: os.remove(local_path)
             except: pass
-        if "Cancelado" in str(e): raise e
+        if isinstance(e, TaskCancelled): raise
 
-        # Log de erro
-        with _dl_lock:
-            if progress_dict and task_id:
-                info = progress_dict[task_id]
+        # Log de erro (só o contador precisa do lock; o append no deque é atômico)
+        if progress_dict and task_id:
+            info = progress_dict[task_id]
+            with _task_lock(task_id):
                 info["errors"] = info.get("errors", 0) + 1
-                hist = info.get("history", [])
-                hist.append(f"FALHA DL {download_name}: {str(e)}")
-                info["history"] = hist
-                progress_dict[task_id] = info
+            info["history"].append(f"FALHA DL {download_name}: {str(e)}")
         return
     finally:
         if not fh.closed: fh.close()
+        if stream_budget:
+            _release_stream_budget(stream_budget)
 
     # Salva o caminho relativo final para o compactador usar depois
-    f_info["local_rel_path"] = final_rel_path
+    # (arquivos já gravados no pacote não passam pela compactação da fase 2)
+    if not stream_to_archive:
+        f_info["local_rel_path"] = final_rel_path
+        f_info["abs_local_path"] = local_path
+        # Modo pacote: já entrega o arquivo para a compactação, que roda em
+        # paralelo com os downloads restantes
+        if on_downloaded is not None:
+            on_downloaded(f_info)
 
     # Atualiza Progresso
-    with _dl_lock:
-        if progress_dict and task_id:
-            info = progress_dict[task_id]
+    if progress_dict and task_id:
+        info = progress_dict[task_id]
+        with _task_lock(task_id):
             dl_now = info.get("files_downloaded", 0) + 1
             info["files_downloaded"] = dl_now
             info["bytes_downloaded"] = info.get("bytes_downloaded", 0) + file_size_bytes
@@ -268,20 +780,70 @@ def _worker_download_one(creds, f_info, dest_root, used_rel_paths, progress_dict
             # Mensagem de status
             info["message"] = f"Baixando ({dl_now}/{total_seen})"
 
-            # Histórico: Loga apenas a cada 20 arquivos para performance
-            if dl_now % 20 == 0:
-                hist = info.get("history", [])
-                size_str = format_size(file_size_bytes)
-                hist.append(f"Baixado: {download_name} ({size_str})")
-                info["history"] = hist
+        # Histórico: Loga apenas a cada 20 arquivos para performance (fora do lock)
+        if dl_now % 20 == 0:
+            size_str = format_size(file_size_bytes)
+            info["history"].append(f"Baixado: {download_name} ({size_str})")
+
+
+
+def _reserve_stream_budget(size: int) -> bool:
+    """Reserva memória para um download médio ir direto ao pacote (não bloqueia)."""
+    global _stream_budget_used
+    with _stream_budget_lock:
+        if _stream_budget_used + size > STREAM_TO_ARCHIVE_BUDGET:
+            return False
+        _stream_budget_used += size
+        return True
 
-            progress_dict[task_id] = info
 
+def _release_stream_budget(size: int):
+    global _stream_budget_used
+    with _stream_budget_lock:
+        _stream_budget_used -= size
+
+
+def _worker_download_limited(limiter, creds, *args, **kwargs):
+    """
+    Roda _worker_download_one ocupando uma vaga do limitador adaptativo.
+    O service vem do pool: o número de conexões abertas acompanha o limite
+    de downloads simultâneos, não o número de threads.
+    """
+    limiter.acquire()
+    service = _checkout_service(creds)
+    try:
+        return _worker_download_one(creds, *args, limiter=limiter, service=service, **kwargs)
+    finally:
+        _checkin_service(creds, service)
+        limiter.release()
+
+
+def _concurrent_mapper(creds, items, q, progress_dict, task_id, filters, on_probe=None):
+    # Com on_probe, os primeiros PRECOMPRESSED_PROBE_FILES arquivos ficam retidos
+    # até a amostra fechar, para a decisão (ex.: ZIP sem DEFLATE) valer para todos
+    probe = [] if on_probe else None
+
+    def _emit(file_obj):
+        if probe is None:
+            q.put(file_obj)
+            return
+        probe.append(file_obj)
+        if len(probe) >= PRECOMPRESSED_PROBE_FILES:
+            _flush_probe()
+
+    def _flush_probe():
+        nonlocal probe
+        if not probe:
+            probe = None
+            return
+        held, probe = probe, None
+        on_probe(held)
+        for file_obj in held:
+            q.put(file_obj)
 
-def _concurrent_mapper(creds, items, q, progress_dict, task_id, filters):
     try:
         service = get_thread_safe_service(creds)
-        stack = []
+        stack = deque()
         for item in items:
             # Sanitiza o nome já no início
             safe = safe_name(item["name"])
@@ -292,88 +854,140 @@ def _concurrent_mapper(creds, items, q, progress_dict, task_id, filters):
                 "rel_path": safe
             })
 
-        while stack:
-            check_status_pause_cancel(progress_dict, task_id)
-            current = stack.pop(0)
-
-            if current["type"] == "file":
-                try:
-                    meta = service.files().get(fileId=current["id"], fields="id,name,mimeType,size").execute()
-                    current["size_bytes"] = int(meta.get("size", 0))
-                    current["mimeType"] = meta.get("mimeType")
-                except:
-                    current["size_bytes"] = 0
-
-                q.put(current)
-                with _dl_lock:
-                    if progress_dict and task_id:
-                        info = progress_dict[task_id]
-                        info["files_total"] = info.get("files_total", 0) + 1
-                        info["bytes_found"] = info.get("bytes_found", 0) + current.get("size_bytes", 0)
-                        info["message"] = f"Mapeando... ({info['files_total']} enc.)"
-                        progress_dict[task_id] = info
-
-            elif current["type"] == "folder":
-                children = get_children(creds, current["id"], include_files=True)
-                for child in children:
-                    check_status_pause_cancel(progress_dict, task_id)
-
-                    # Constrói caminho relativo limpando o nome do filho
-                    child_clean_name = safe_name(child["name"])
-                    child_rel = os.path.join(current["rel_path"], child_clean_name)
-
-                    if child["type"] == "folder":
-                        stack.append({
-                            "id": child["id"],
-                            "name": child["name"],
-                            "type": "folder",
-                            "rel_path": child_rel
-                        })
-                    else:
-                        if filters and not file_passes_filters(child, filters):
-                            continue
-                        file_obj = {
-                            "id": child["id"],
-                            "name": child["name"],
-                            "mimeType": child.get("mimeType"),
-                            "rel_path": child_rel,
-                            "type": "file",
-                            "size_bytes": child.get("size_bytes", 0)
-                        }
-                        q.put(file_obj)
-
-                        # Atualiza totais encontrados
-                        with _dl_lock:
+        # Metadados dos arquivos raiz num batch HTTP só, em vez de um get por arquivo
+        root_file_ids = [it["id"] for it in stack if it["type"] == "file"]
+        root_meta = get_files_metadata_many(
+            service, root_file_ids, "id,name,mimeType,size,shortcutDetails(targetId)"
+        ) if root_file_ids else {}
+
+        # Várias listagens de pasta em voo ao mesmo tempo: em árvores profundas o
+        # mapeamento serial deixava os workers de download esperando
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAPPER_LIST_WORKERS) as executor:
+            pending = {}
+            while stack or pending:
+                check_status_pause_cancel(progress_dict, task_id)
+
+                while stack and len(pending) < MAPPER_LIST_WORKERS:
+                    current = stack.popleft()
+
+                    if current["type"] == "folder":
+                        # Agrupa as próximas pastas da fila numa única listagem,
+                        # repartindo a fila entre os slots livres do executor
+                        free_slots = MAPPER_LIST_WORKERS - len(pending)
+                        limit = min(FOLDERS_PER_LIST_QUERY, -(-(len(stack) + 1) // free_slots))
+                        batch = [current]
+                        while (stack and stack[0]["type"] == "folder"
+                               and len(batch) < limit):
+                            batch.append(stack.popleft())
+                        fut = executor.submit(
+                            get_children_many, creds, [f["id"] for f in batch], True
+                        )
+                        pending[fut] = batch
+                        continue
+
+                    if current["type"] == "file":
+                        meta = root_meta.get(current["id"])
+                        if meta is not None:
+                            current["size_bytes"] = int(meta.get("size", 0))
+                            current["mimeType"] = meta.get("mimeType")
+                            target = (meta.get("shortcutDetails") or {}).get("targetId")
+                            if target:
+                                current["shortcutTargetId"] = target
+                        else:
+                            current["size_bytes"] = 0
+
+                        _emit(current)
+                        with _task_lock(task_id):
                             if progress_dict and task_id:
                                 info = progress_dict[task_id]
                                 info["files_total"] = info.get("files_total", 0) + 1
-                                info["bytes_found"] = info.get("bytes_found", 0) + file_obj["size_bytes"]
+                                info["bytes_found"] = info.get("bytes_found", 0) + current.get("size_bytes", 0)
                                 info["message"] = f"Mapeando... ({info['files_total']} enc.)"
-                                progress_dict[task_id] = info
+
+                if not pending:
+                    continue
+
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for fut in done:
+                    batch = pending.pop(fut)
+                    try:
+                        children_by_folder = fut.result()
+                    except Exception as e:
+                        # Um lote que falhou não derruba o resto do mapeamento:
+                        # registra e segue com as demais pastas da fila
+                        if progress_dict and task_id:
+                            names = ", ".join(f["rel_path"] for f in batch[:3])
+                            progress_dict[task_id]["history"].append(
+                                f"Erro ao listar {len(batch)} pasta(s) ({names}): {str(e)}"
+                            )
+                        continue
+                    for current in batch:
+                        check_status_pause_cancel(progress_dict, task_id)
+                        # Prefixo montado uma vez por pasta; cada filho só concatena o nome limpo
+                        prefix = current["rel_path"] + os.sep
+                        for child in children_by_folder.get(current["id"], []):
+                            child_rel = prefix + safe_name(child["name"])
+
+                            if child["type"] == "folder":
+                                stack.append({
+                                    "id": child["id"],
+                                    "name": child["name"],
+                                    "type": "folder",
+                                    "rel_path": child_rel
+                                })
+                            else:
+                                if filters and not file_passes_filters(child, filters):
+                                    continue
+                                file_obj = {
+                                    "id": child["id"],
+                                    "name": child["name"],
+                                    "mimeType": child.get("mimeType"),
+                                    "rel_path": child_rel,
+                                    "type": "file",
+                                    "size_bytes": child.get("size_bytes", 0)
+                                }
+                                if child.get("shortcutTargetId"):
+                                    file_obj["shortcutTargetId"] = child["shortcutTargetId"]
+                                _emit(file_obj)
+
+                                # Atualiza totais encontrados
+                                with _task_lock(task_id):
+                                    if progress_dict and task_id:
+                                        info = progress_dict[task_id]
+                                        info["files_total"] = info.get("files_total", 0) + 1
+                                        info["bytes_found"] = info.get("bytes_found", 0) + file_obj["size_bytes"]
+                                        info["message"] = f"Mapeando... ({info['files_total']} enc.)"
     except Exception as e:
-        with _dl_lock:
-             if progress_dict and task_id:
-                hist = progress_dict[task_id].get("history", [])
-                hist.append(f"Erro no mapeamento: {str(e)}")
-                progress_dict[task_id]["history"] = hist
+        if progress_dict and task_id:
+            progress_dict[task_id]["history"].append(f"Erro no mapeamento: {str(e)}")
+    finally:
+        # Amostra menor que PRECOMPRESSED_PROBE_FILES (ou mapeamento interrompido)
+        if probe is not None:
+            _flush_probe()
 
 
-def _concurrent_worker(creds, q, dest_root, used_rel_paths, progress_dict, task_id, filters, results_list):
-    # Inicializa serviço na thread
-    get_thread_safe_service(creds)
+def _concurrent_worker(creds, q, dest_root, used_rel_paths, known_dirs, progress_dict, task_id, filters, results_list,
+                       limiter, archive=None, on_downloaded=None):
+    # O service (e a conexão HTTPS dele) vem do pool a cada arquivo:
+    # workers que nunca recebem item não abrem conexão nenhuma
     while True:
-        try:
-            item = q.get(timeout=2)
-        except queue.Empty:
-            return
+        # Bloqueia até chegar trabalho: o fim é sinalizado só pelo poison pill.
+        # (Com timeout, workers ociosos morriam enquanto o mapeamento ainda listava
+        # pastas grandes, e a fila podia ficar sem consumidores.)
+        item = q.get()
 
         if item is None:
+            q.task_done()
             break
 
         try:
-            _worker_download_one(creds, item, dest_root, used_rel_paths, progress_dict, task_id, filters)
-            with _dl_lock:
-                results_list.append(item)
+            _worker_download_limited(
+                limiter, creds, item, dest_root, used_rel_paths, known_dirs, progress_dict, task_id, filters,
+                archive=archive, on_downloaded=on_downloaded,
+            )
+            results_list.append(item)  # list.append já é atômico
         except Exception as e:
             # Erros já são logados dentro do _worker_download_one
             pass
@@ -381,24 +995,35 @@ def _concurrent_worker(creds, q, dest_root, used_rel_paths, progress_dict, task_
             q.task_done()
 
 
-def execute_concurrent_download(creds, items, dest_root, progress_dict, task_id, filters):
-    file_queue = queue.Queue()
+def execute_concurrent_download(creds, items, dest_root, progress_dict, task_id, filters, archive=None,
+                                on_downloaded=None, max_workers=None, on_probe=None):
+    # Teto de downloads simultâneos (padrão: DOWNLOAD_MAX_WORKERS do config)
+    max_workers = max(1, max_workers or MAX_DOWNLOAD_WORKERS)
+    filters = active_filters(filters)
+    # Resolve o caminho longo uma única vez; os workers só concatenam o relativo
+    dest_root = StorageService.prepare_long_path(dest_root)
+    # Fila limitada: o mapeamento lista bem mais rápido do que os downloads
+    # andam, então o put() bloqueia em vez de manter a árvore toda em memória
+    file_queue = queue.Queue(maxsize=max_workers * SUBMIT_WINDOW_FACTOR)
     results_list = []
-    used_rel_paths = set()
+    used_rel_paths = {}
+    known_dirs = set()
+    limiter = _AdaptiveLimiter(max_workers)
 
     # 1. Thread de Mapeamento (Producer)
     mapper_thread = threading.Thread(
         target=_concurrent_mapper,
-        args=(creds, items, file_queue, progress_dict, task_id, filters)
+        args=(creds, items, file_queue, progress_dict, task_id, filters, on_probe)
     )
     mapper_thread.start()
 
     # 2. Threads de Download (Consumers)
     workers = []
-    for _ in range(MAX_DOWNLOAD_WORKERS):
+    for _ in range(max_workers):
         t = threading.Thread(
             target=_concurrent_worker,
-            args=(creds, file_queue, dest_root, used_rel_paths, progress_dict, task_id, filters, results_list)
+            args=(creds, file_queue, dest_root, used_rel_paths, known_dirs, progress_dict, task_id, filters, results_list,
+                  limiter, archive, on_downloaded)
         )
         t.start()
         workers.append(t)
@@ -408,7 +1033,7 @@ def execute_concurrent_download(creds, items, dest_root, progress_dict, task_id,
 
     # Sinaliza fim da fila
     file_queue.join() # Espera processar o que já está na fila
-    for _ in range(MAX_DOWNLOAD_WORKERS):
+    for _ in range(max_workers):
         file_queue.put(None) # Poison pill
 
     # Espera Workers
@@ -418,16 +1043,404 @@ def execute_concurrent_download(creds, items, dest_root, progress_dict, task_id,
     return results_list
 
 
+# Formatos já comprimidos: passar de novo pelo DEFLATE só gasta CPU sem reduzir
+# o tamanho (inclui os OOXML gerados pela exportação do Google Docs/Sheets/Slides)
+_STORED_EXTS = frozenset({
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".avif",
+    ".mp4", ".m4v", ".mov", ".mkv", ".avi", ".wmv", ".webm",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".pdf", ".epub", ".jar", ".apk",
+})
+
+
+# Amostra do início da lista: se a maioria já vem comprimida, o ZIP inteiro vai sem DEFLATE
+_PRECOMPRESSED_MIME_PREFIXES = (
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/heic",
+    "video/", "audio/",
+    "application/pdf", "application/zip", "application/x-7z-compressed",
+    "application/vnd.openxmlformats",
+)
+PRECOMPRESSED_PROBE_FILES = 20
+PRECOMPRESSED_PROBE_RATIO = 0.7
+
+
+def _files_found(results_list: list, progress_dict, task_id) -> bool:
+    """
+    True se o modo concorrente encontrou algum arquivo. O total vem do
+    mapeamento (files_total), não da lista de baixados, que fica vazia
+    também quando todos os downloads falham.
+    """
+    if results_list:
+        return True
+    if progress_dict and task_id and task_id in progress_dict:
+        return progress_dict[task_id].get("files_total", 0) > 0
+    return False
+
+
+def _mostly_precompressed(files_list: list) -> bool:
+    """True se a maior parte dos primeiros arquivos da lista for mídia/formato já comprimido."""
+    sample = files_list[:PRECOMPRESSED_PROBE_FILES]
+    if not sample:
+        return False
+    hits = sum(
+        1 for f in sample
+        if (f.get("mimeType") or "").startswith(_PRECOMPRESSED_MIME_PREFIXES)
+    )
+    return hits >= len(sample) * PRECOMPRESSED_PROBE_RATIO
+
+
+def _zip_compress_type(arcname: str, mime_type: str | None = None):
+    """
+    ZIP_STORED para formatos incompressíveis; None mantém a compressão do arquivo.
+    O mimeType do Drive cobre os arquivos sem extensão (ou com extensão errada).
+    """
+    ext = os.path.splitext(arcname)[1].lower()
+    if ext in _STORED_EXTS or (mime_type or "").startswith(_PRECOMPRESSED_MIME_PREFIXES):
+        return zipfile.ZIP_STORED
+    return None
+
+
+def _prepare_member(arcname: str, data: bytes, compress_type: int, level):
+    """
+    Monta um membro do ZIP (DEFLATE ou STORED) fora do _archive_lock.
+    zlib/ISA-L liberam o GIL, então as threads de compactação comprimem e
+    calculam o CRC em paralelo e só a gravação final fica serializada.
+    """
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = 0o600 << 16  # mesmo padrão do writestr
+    zinfo.file_size = len(data)
+    zinfo.CRC = _crc32(data)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = _deflate_compressor(level)
+        payload = compressor.compress(data) + compressor.flush()
+    else:
+        payload = data
+    zinfo.compress_size = len(payload)
+    return zinfo, payload
+
+
+# Campos internos do ZipFile usados na gravação direta dos membros prontos
+# (_write_prepared_member/_write_raw_member_file). Sem algum deles (outra
+# versão do Python), volta para o writestr/open do próprio zipfile.
+_ZIP_RAW_WRITE_ATTRS = ("_lock", "_writecheck", "_didModify", "start_dir", "_seekable", "fp")
+
+
+def _zip_raw_write_ok(zf: zipfile.ZipFile) -> bool:
+    """True se dá para gravar membros prontos direto no ZIP (arquivo com seek)."""
+    return all(hasattr(zf, attr) for attr in _ZIP_RAW_WRITE_ATTRS) and bool(zf._seekable)
+
+
+def _write_prepared_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: bytes):
+    """Grava no ZIP um membro montado por _prepare_member (chamar com _archive_lock)."""
+    with zf._lock:
+        if zf._seekable:
+            zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.fp.write(zinfo.FileHeader())
+        zf.fp.write(payload)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
+
+
+def _crc32_file(path: str) -> int:
+    """CRC32 de um arquivo em blocos de TAR_COPY_BUFSIZE (sem lock, roda em paralelo)."""
+    crc = 0
+    buf = bytearray(TAR_COPY_BUFSIZE)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            crc = _crc32(view[:n], crc)
+    return crc
+
+
+def _deflate_file_to_spool(src_path: str, arcname: str, level) -> tuple[zipfile.ZipInfo, str]:
+    """
+    Comprime um arquivo grande para um spool temporário ao lado dele, fora do
+    _archive_lock, no mesmo formato de um membro DEFLATE do ZIP. Assim várias
+    threads comprimem arquivos grandes ao mesmo tempo e o lock só cobre a
+    cópia dos bytes prontos (ver _write_raw_member_file).
+    """
+    zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    compressor = _deflate_compressor(level)
+    spool_path = src_path + ".deflate"
+    crc = 0
+    file_size = 0
+    buf = bytearray(TAR_COPY_BUFSIZE)
+    view = memoryview(buf)
+    try:
+        with open(src_path, "rb", buffering=0) as src, open(spool_path, "wb") as spool:
+            while True:
+                n = src.readinto(buf)
+                if not n:
+                    break
+                chunk = view[:n]
+                crc = _crc32(chunk, crc)
+                file_size += n
+                spool.write(compressor.compress(chunk))
+            spool.write(compressor.flush())
+            zinfo.compress_size = spool.tell()
+    except BaseException:
+        try: os.remove(spool_path)
+        except OSError: pass
+        raise
+    zinfo.file_size = file_size
+    zinfo.CRC = crc
+    return zinfo, spool_path
+
+
+def _write_raw_member_file(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, src_path: str):
+    """
+    Grava um membro cujo conteúdo já está pronto em disco (ZIP_STORED: o
+    próprio arquivo; DEFLATE: o spool), sem recomprimir. No Linux a cópia
+    é feita pelo kernel (os.sendfile). zinfo já precisa vir com tamanhos e
+    CRC calculados (chamar com _archive_lock).
+    """
+    with zf._lock:
+        if zf._seekable:
+            zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        header = zinfo.FileHeader()
+        zf.fp.write(header)
+        zf.fp.flush()
+
+        size = zinfo.compress_size
+        with open(src_path, "rb", buffering=0) as src:
+            if hasattr(os, "sendfile"):
+                out_fd = zf.fp.fileno()
+                sent = 0
+                while sent < size:
+                    n = os.sendfile(out_fd, src.fileno(), sent, size - sent)
+                    if n == 0:
+                        break
+                    sent += n
+                if sent != size:
+                    raise OSError(f"sendfile copiou {sent} de {size} bytes: {src_path}")
+                # O sendfile escreveu direto no fd: ressincroniza a posição do objeto Python
+                zf.fp.seek(zinfo.header_offset + len(header) + size)
+            else:
+                shutil.copyfileobj(src, zf.fp, TAR_COPY_BUFSIZE)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
+
+
+def _zip_write_file(zf: zipfile.ZipFile, src_path: str, arcname: str, compress_type=None):
+    """
+    Equivalente ao ZipFile.write para arquivos grandes, mas copiando em blocos
+    de TAR_COPY_BUFSIZE (o write do zipfile lê de 8 KiB em 8 KiB).
+    Chamar com _archive_lock.
+    """
+    zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+    zinfo.compress_type = compress_type if compress_type is not None else zf.compression
+    if zinfo.compress_type != zipfile.ZIP_STORED:
+        # Nome do atributo mudou no 3.13 (compress_level)
+        if hasattr(zinfo, "compress_level"):
+            zinfo.compress_level = zf.compresslevel
+        else:
+            zinfo._compresslevel = zf.compresslevel
+    with open(src_path, "rb", buffering=0) as src, zf.open(zinfo, "w", force_zip64=True) as dest:
+        shutil.copyfileobj(src, dest, TAR_COPY_BUFSIZE)
+
+
+def _archive_bytes(archive_obj, archive_format: str, arcname: str, data: bytes, mime_type: str | None = None):
+    """Adiciona ao ZIP/TAR um membro que já está em memória (no ZIP, comprime fora do lock)."""
+    if archive_format == "zip":
+        compress_type = _zip_compress_type(arcname, mime_type)
+        if compress_type is None:
+            compress_type = archive_obj.compression
+        if compress_type in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED) and _zip_raw_write_ok(archive_obj):
+            member = _prepare_member(arcname, data, compress_type, archive_obj.compresslevel)
+            with _archive_lock:
+                _write_prepared_member(archive_obj, *member)
+        else:
+            with _archive_lock:
+                archive_obj.writestr(arcname, data, compress_type=compress_type)
+    else:
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        tarinfo.mtime = time.time()
+        with _archive_lock:
+            archive_obj.addfile(tarinfo, io.BytesIO(data))
+
+
+class _ParallelGzipWriter:
+    """
+    Arquivo de escrita que gera gzip em paralelo, no estilo do pigz: a entrada
+    é cortada em blocos de GZIP_BLOCK_SIZE e cada bloco vira um membro gzip
+    próprio, comprimido em uma thread (zlib e ISA-L soltam o GIL). Membros
+    concatenados são um .gz válido para gzip/gunzip/tarfile.
+    Os blocos são gravados na ordem em que foram escritos.
+    """
+
+    def __init__(self, path: str, compress, workers: int):
+        self._fp = open(path, "wb")
+        self._compress = compress
+        self._workers = max(1, workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+        self._pending = deque()
+        self._buf = bytearray()
+        self._pos = 0
+        self.closed = False
+
+    def _submit(self, block: bytes):
+        self._pending.append(self._executor.submit(self._compress, block))
+        # Limita os blocos em voo para não acumular a saída em memória
+        while len(self._pending) > self._workers * 2:
+            self._fp.write(self._pending.popleft().result())
+
+    def write(self, data) -> int:
+        n = len(data)
+        self._buf += data
+        self._pos += n
+        while len(self._buf) >= GZIP_BLOCK_SIZE:
+            self._submit(bytes(self._buf[:GZIP_BLOCK_SIZE]))
+            del self._buf[:GZIP_BLOCK_SIZE]
+        return n
+
+    def tell(self) -> int:
+        # Posição no stream descomprimido (o tarfile só usa isso como offset)
+        return self._pos
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._buf:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            while self._pending:
+                self._fp.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._fp.close()
+
+
+# pigz instalado no sistema: comprime o tar.gz em processo separado, em todos os núcleos
+PIGZ_BIN = shutil.which("pigz")
+
+
+class _PigzPipe:
+    """
+    Mesma interface do _ParallelGzipWriter, mas o stream vai por pipe para um
+    processo `pigz -p N`, que grava o .gz direto no arquivo de saída.
+    """
+
+    def __init__(self, path: str, level: int, workers: int):
+        self._out = open(path, "wb")
+        try:
+            self._proc = subprocess.Popen(
+                [PIGZ_BIN, "-p", str(max(1, workers)), f"-{level}", "-c"],
+                stdin=subprocess.PIPE,
+                stdout=self._out,
+            )
+        except OSError:
+            self._out.close()
+            raise
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._proc.stdin.write(data)
+        n = len(data)
+        self._pos += n
+        return n
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._proc.stdin.close()
+            returncode = self._proc.wait()
+        finally:
+            self._out.close()
+        if returncode != 0:
+            raise OSError(f"pigz terminou com código {returncode}")
+
+
+def _open_gzip_writer(archive_path: str, zlib_level: int, isal_level: int):
+    """pigz externo quando existir; senão o gzip em blocos paralelos (ISA-L/zlib)."""
+    workers = os.cpu_count() or 1
+    if PIGZ_BIN:
+        try:
+            return _PigzPipe(archive_path, zlib_level, workers)
+        except OSError:
+            pass
+    if igzip is not None:
+        compress = functools.partial(igzip.compress, compresslevel=isal_level, mtime=0)
+    else:
+        compress = functools.partial(gzip.compress, compresslevel=zlib_level, mtime=0)
+    return _ParallelGzipWriter(archive_path, compress, workers)
+
+
+def _open_bundle_archive(out_dir: str, base_name: str, archive_format: str, compression_level: str):
+    """Abre o ZIP/TAR.GZ/TAR.ZST de saída. Retorna (archive_path, archive_obj, gzip_obj)."""
+    gzip_obj = None
+    zlib_level, isal_level = _COMPRESSION_LEVELS.get(
+        compression_level, _DEFAULT_COMPRESSION_LEVEL
+    )
+
+    if archive_format == "zip":
+        archive_path = os.path.join(out_dir, f"{base_name}.zip")
+        archive_obj = _BundleZipFile(
+            archive_path,
+            "w",
+            compression=zipfile.ZIP_DEFLATED,
+            compresslevel=zlib_level,
+            allowZip64=True,
+        )
+    elif archive_format == "tar.zst" and pyzstd is not None:
+        archive_path = os.path.join(out_dir, f"{base_name}.tar.zst")
+        # nbWorkers: o próprio zstd comprime o stream em várias threads
+        gzip_obj = pyzstd.ZstdFile(
+            archive_path,
+            "wb",
+            level_or_option={
+                pyzstd.CParameter.compressionLevel: _ZSTD_LEVELS.get(
+                    compression_level, _DEFAULT_ZSTD_LEVEL
+                ),
+                pyzstd.CParameter.nbWorkers: os.cpu_count() or 1,
+            },
+        )
+        archive_obj = tarfile.open(
+            fileobj=gzip_obj, mode="w", copybufsize=TAR_COPY_BUFSIZE
+        )
+    else:
+        # tar.gz (e fallback do tar.zst quando o pyzstd não está instalado)
+        archive_path = os.path.join(out_dir, f"{base_name}.tar.gz")
+        gzip_obj = _open_gzip_writer(archive_path, zlib_level, isal_level)
+        archive_obj = tarfile.open(
+            fileobj=gzip_obj, mode="w", copybufsize=TAR_COPY_BUFSIZE
+        )
+
+    return archive_path, archive_obj, gzip_obj
+
+
 def _worker_archive_one(f_info, tmp_root, archive_obj, archive_format, progress_dict, task_id):
     rel = f_info.get("local_rel_path")
     if not rel: return
 
-    src = os.path.join(tmp_root, rel)
-    src_long = StorageService.prepare_long_path(src)
-
-    if not os.path.exists(src_long):
-        return
+    # O worker de download já guarda o caminho absoluto (com prefixo de caminho
+    # longo); o join com tmp_root fica só de reserva
+    src_long = f_info.get("abs_local_path") or os.path.join(tmp_root, rel)
 
+    # local_rel_path só é definido quando o download terminou, então não há
+    # stat() extra por arquivo: um sumiço raro cai no FileNotFoundError abaixo
     check_status_pause_cancel(progress_dict, task_id)
 
     # Corrige barras para ZIP (padrão UNIX /)
@@ -436,26 +1449,81 @@ def _worker_archive_one(f_info, tmp_root, archive_obj, archive_format, progress_
     try:
         file_size = os.path.getsize(src_long)
 
-        file_content = None
-        # Lê arquivos pequenos/médios para RAM para liberar IO de disco
+        # Arquivos pequenos/médios: lidos para RAM fora do lock (ZIP comprime em
+        # paralelo; TAR só copia da memória), em vez de o add/write ler o disco
+        # segurando o lock do pacote.
+        # Sem buffer do Python: FileIO.readall aloca o tamanho do fstat de uma vez
         if file_size < MEMORY_BUFFER_LIMIT:
-            with open(src_long, "rb") as f:
+            with open(src_long, "rb", buffering=0) as f:
                 file_content = f.read()
+            _archive_bytes(
+                archive_obj, archive_format, arcname_fixed, file_content, f_info.get("mimeType")
+            )
+            return
+
+        if archive_format == "zip":
+            compress_type = _zip_compress_type(arcname_fixed, f_info.get("mimeType"))
+            if compress_type is None:
+                compress_type = archive_obj.compression
+
+            # ZIP_STORED: CRC (ISA-L, se houver) fora do lock; a cópia vai pelo
+            # kernel (sendfile) no Linux e em blocos grandes nos demais sistemas
+            if compress_type == zipfile.ZIP_STORED and _zip_raw_write_ok(archive_obj):
+                zinfo = zipfile.ZipInfo.from_file(src_long, arcname_fixed)
+                zinfo.compress_type = zipfile.ZIP_STORED
+                zinfo.compress_size = zinfo.file_size
+                zinfo.CRC = _crc32_file(src_long)
+                with _archive_lock:
+                    _write_raw_member_file(archive_obj, zinfo, src_long)
+                return
+
+            # DEFLATE: comprime para um spool sem lock; o lock só cobre a cópia
+            if compress_type == zipfile.ZIP_DEFLATED and _zip_raw_write_ok(archive_obj):
+                zinfo, spool_path = _deflate_file_to_spool(
+                    src_long, arcname_fixed, archive_obj.compresslevel
+                )
+                try:
+                    with _archive_lock:
+                        _write_raw_member_file(archive_obj, zinfo, spool_path)
+                finally:
+                    os.remove(spool_path)
+                return
 
         # Bloqueio apenas para escrita no ZIP/TAR
         with _archive_lock:
             if archive_format == "zip":
-                if file_content is not None:
-                    archive_obj.writestr(arcname_fixed, file_content)
-                else:
-                    archive_obj.write(src_long, arcname=arcname_fixed)
+                _zip_write_file(archive_obj, src_long, arcname_fixed, compress_type)
             else:
                 archive_obj.add(src_long, arcname=arcname_fixed)
 
+    except FileNotFoundError:
+        return
     except Exception as e:
         print(f"Erro ao compactar {rel}: {e}")
 
 
+def _job_dirs(files_list: list[dict], dest_root: str, archive=None) -> set:
+    """
+    Pastas de destino do job, com os mesmos nomes limpos que o
+    _worker_download_one usa. No modo pacote, arquivos que vão direto da
+    memória para o ZIP/TAR não precisam de pasta no disco.
+    """
+    dirs = set()
+    for f in files_list:
+        raw_rel_path = f.get("rel_path")
+        if not raw_rel_path:
+            continue
+        if archive is not None and (
+            f.get("size_bytes", 0) <= STREAM_TO_ARCHIVE_LIMIT
+            or (f.get("mimeType") or "").startswith("application/vnd.google-apps.")
+        ):
+            continue
+        parts = raw_rel_path.replace('\\', '/').split('/')[:-1]
+        if parts:
+            dirs.add(os.path.join(dest_root, *(safe_name(p) for p in parts)))
+    return dirs
+
+
 def download_files_to_folder(
     creds,
     files_list: list[dict],
@@ -464,6 +1532,9 @@ def download_files_to_folder(
     task_id: str | None = None,
     filters: dict | None = None,
     processing_mode: str = "sequential",
+    archive=None,
+    on_downloaded=None,
+    max_workers: int | None = None,
 ) -> None:
     if not files_list:
         return
@@ -479,32 +1550,49 @@ def download_files_to_folder(
     })
     sync_task_to_db(task_id)
 
-    used_rel_paths = set()
-    changes_since_sync = 0
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
-        futures = []
-        for f_info in files_list:
-            fut = executor.submit(
-                _worker_download_one, creds, f_info, dest_root, used_rel_paths, progress_dict, task_id, filters
+    dest_root = StorageService.prepare_long_path(dest_root)
+    used_rel_paths = {}
+    known_dirs = set()
+
+    # Cria as pastas numa passada só: os workers não disputam o lock do
+    # ensure_dir_cached nem fazem um makedirs por pasta nova
+    StorageService.ensure_dirs(_job_dirs(files_list, dest_root, archive), known_dirs)
+
+    # Jobs pequenos não precisam de um pool maior que a quantidade de arquivos
+    workers = min(max(1, max_workers or MAX_DOWNLOAD_WORKERS), total)
+    limiter = _AdaptiveLimiter(workers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Janela deslizante: no máximo workers * SUBMIT_WINDOW_FACTOR futures vivos,
+        # em vez de criar um Future por arquivo do job logo de início
+        pending_files = iter(files_list)
+        in_flight = set()
+        refill = workers * SUBMIT_WINDOW_FACTOR
+
+        while True:
+            for f_info in itertools.islice(pending_files, refill):
+                in_flight.add(executor.submit(
+                    _worker_download_limited,
+                    limiter, creds, f_info, dest_root, used_rel_paths, known_dirs, progress_dict, task_id, filters,
+                    archive=archive, on_downloaded=on_downloaded,
+                ))
+            if not in_flight:
+                break
+
+            done, in_flight = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
             )
-            futures.append(fut)
-
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-                changes_since_sync += 1
-                if progress_dict and task_id and changes_since_sync >= 25:
-                    sync_task_to_db(task_id)
-                    changes_since_sync = 0
-            except Exception as exc:
-                if "Cancelado" in str(exc):
-                    for f in futures: f.cancel()
-                    sync_task_to_db(task_id)
-                    raise exc
+            refill = len(done)
 
-    if progress_dict and task_id:
-        sync_task_to_db(task_id)
+            for future in done:
+                try:
+                    future.result()
+                except TaskCancelled:
+                    for f in in_flight: f.cancel()
+                    raise
+                except Exception:
+                    # Falhas por arquivo já foram contadas/logadas pelo próprio worker
+                    pass
 
 def handle_remove_readonly(func, path, exc):
     """
@@ -531,6 +1619,7 @@ def download_items_bundle(
     task_id: str | None = None,
     filters: dict | None = None,
     processing_mode: str = "sequential",
+    max_workers: int | None = None,
 ) -> str:
 
     # Diretório base de trabalho temporário:
@@ -538,117 +1627,145 @@ def download_items_bundle(
     local_temp_base = StorageService.temp_work_dir()
 
     tmp_root = tempfile.mkdtemp(prefix="dl_", dir=local_temp_base)
+    tmp_root_long = StorageService.prepare_long_path(tmp_root)
 
     files_list_result = []
 
-    try:
-        check_status_pause_cancel(progress_dict, task_id)
+    # O pacote é aberto antes do download: arquivos pequenos e exportações
+    # são gravados nele direto pelos workers, sem passar pelo tmp_root
+    out_dir = tempfile.mkdtemp(prefix="out_", dir=local_temp_base)
+    if not base_name:
+        base_name = "backup_drive"
+    base_name = safe_name(base_name)
 
-        # 1. DOWNLOAD (Concorrente ou Sequencial)
-        if processing_mode == "concurrent":
+    archive_path, archive_obj, gzip_obj = _open_bundle_archive(
+        out_dir, base_name, archive_format, compression_level
+    )
+    archive = (archive_obj, archive_format)
+
+    # Compactação em pipeline: cada arquivo que termina de baixar no tmp_root
+    # já vai para o pacote enquanto os outros downloads seguem
+    archive_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_ARCHIVE_WORKERS)
+    # Limita os arquivos esperando compactação: se o pacote atrasar, o worker
+    # de download espera aqui em vez de acumular Futures (e disco no tmp_root)
+    archive_slots = threading.BoundedSemaphore(MAX_ARCHIVE_WORKERS * SUBMIT_WINDOW_FACTOR)
+    archive_errors = []
+
+    def _archive_done(future):
+        archive_slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            archive_errors.append(future.exception())
+
+    def _archive_downloaded(f_info):
+        archive_slots.acquire()
+        try:
+            future = archive_executor.submit(
+                _worker_archive_one,
+                f_info,
+                tmp_root_long,
+                archive_obj,
+                archive_format,
+                progress_dict,
+                task_id,
+            )
+        except BaseException:
+            archive_slots.release()
+            raise
+        future.add_done_callback(_archive_done)
+
+    def _probe_precompressed(files_sample):
+        if _mostly_precompressed(files_sample):
+            # Troca só o padrão do ZIP: membros sem compress_type explícito vão sem DEFLATE
+            archive_obj.compression = zipfile.ZIP_STORED
             update_progress(task_id, {
-                "phase": "mapeando",
-                "message": "MODO TURBO: Mapeando e Baixando simultaneamente...",
-                "files_total": 0,
-                "bytes_found": 0,
-                "bytes_downloaded": 0,
-                "history": ["Iniciando Modo Concorrente..."]
+                "history": ["Conteúdo majoritariamente já comprimido: ZIP sem DEFLATE."]
             })
-            files_list_result = execute_concurrent_download(
-                creds, items, tmp_root, progress_dict, task_id, filters
-            )
-        else:
-            service_main = build("drive", "v3", credentials=creds)
-            files_list_result = build_files_list_for_items(
-                service_main,
-                items,
-                creds=creds,
-                filters=filters,
-                progress_dict=progress_dict,
-                task_id=task_id,
-            )
-
-            if not files_list_result:
-                raise Exception("Nenhum arquivo encontrado.")
-
-            download_files_to_folder(
-                creds,
-                files_list_result,
-                dest_root=tmp_root,
-                progress_dict=progress_dict,
-                task_id=task_id,
-                filters=filters,
-                processing_mode=processing_mode,
-            )
-
-        check_status_pause_cancel(progress_dict, task_id)
-
-        # 2. COMPACTAÇÃO
-        update_progress(task_id, {
-            "phase": "compactando",
-            "message": "Compactando (Multi-thread)...",
-            "history": ["Iniciando compactação..."]
-        })
-        sync_task_to_db(task_id)
 
-        out_dir = tempfile.mkdtemp(prefix="out_", dir=local_temp_base)
-        if not base_name:
-            base_name = "backup_drive"
-        base_name = safe_name(base_name)
-
-        archive_path = ""
-        archive_obj = None
-
-        if archive_format == "zip":
-            archive_path = os.path.join(out_dir, f"{base_name}.zip")
-            comp = zipfile.ZIP_DEFLATED
-            level = 1 if compression_level == "fast" else (9 if compression_level == "max" else 6)
-            archive_obj = zipfile.ZipFile(
-                archive_path,
-                "w",
-                compression=comp,
-                compresslevel=level,
-                allowZip64=True,
-            )
-        else:
-            archive_path = os.path.join(out_dir, f"{base_name}.tar.gz")
-            archive_obj = tarfile.open(archive_path, "w:gz")
+    try:
+        # Progresso vai para o banco por uma thread, não a cada arquivo
+        with periodic_db_sync(task_id, DB_SYNC_INTERVAL):
+            try:
+                check_status_pause_cancel(progress_dict, task_id)
+
+                # 1. DOWNLOAD (Concorrente ou Sequencial)
+                if processing_mode == "concurrent":
+                    update_progress(task_id, {
+                        "phase": "mapeando",
+                        "message": "MODO TURBO: Mapeando e Baixando simultaneamente...",
+                        "files_total": 0,
+                        "bytes_found": 0,
+                        "bytes_downloaded": 0,
+                        "history": ["Iniciando Modo Concorrente..."]
+                    })
+                    files_list_result = execute_concurrent_download(
+                        creds, items, tmp_root, progress_dict, task_id, filters, archive=archive,
+                        on_downloaded=_archive_downloaded, max_workers=max_workers,
+                        on_probe=_probe_precompressed if archive_format == "zip" else None,
+                    )
+                    if not _files_found(files_list_result, progress_dict, task_id):
+                        raise Exception("Nenhum arquivo encontrado.")
+                else:
+                    service_main = get_thread_safe_service(creds)
+                    files_list_result = build_files_list_for_items(
+                        service_main,
+                        items,
+                        creds=creds,
+                        filters=filters,
+                        progress_dict=progress_dict,
+                        task_id=task_id,
+                    )
 
-        try:
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=MAX_ARCHIVE_WORKERS
-            ) as executor:
-                futures = []
-                for f_info in files_list_result:
-                    fut = executor.submit(
-                        _worker_archive_one,
-                        f_info,
-                        tmp_root,
-                        archive_obj,
-                        archive_format,
-                        progress_dict,
-                        task_id,
+                    if not files_list_result:
+                        raise Exception("Nenhum arquivo encontrado.")
+
+                    if archive_format == "zip":
+                        _probe_precompressed(files_list_result)
+
+                    download_files_to_folder(
+                        creds,
+                        files_list_result,
+                        dest_root=tmp_root,
+                        progress_dict=progress_dict,
+                        task_id=task_id,
+                        filters=filters,
+                        processing_mode=processing_mode,
+                        archive=archive,
+                        on_downloaded=_archive_downloaded,
+                        max_workers=max_workers,
                     )
-                    futures.append(fut)
 
-                # Aguarda todas as threads de compactação
-                for future in concurrent.futures.as_completed(futures):
-                    future.result()
-        finally:
-            if archive_obj:
+                check_status_pause_cancel(progress_dict, task_id)
+
+                # 2. COMPACTAÇÃO: termina o que ainda está na fila do pipeline
+                update_progress(task_id, {
+                    "phase": "compactando",
+                    "message": "Finalizando compactação (Multi-thread)...",
+                    "history": ["Finalizando compactação..."]
+                })
+                sync_task_to_db(task_id)
+
+                archive_executor.shutdown(wait=True)
+                if archive_errors:
+                    raise archive_errors[0]
+            finally:
+                # Nenhuma thread pode escrever no pacote depois do close
+                archive_executor.shutdown(wait=True, cancel_futures=True)
                 archive_obj.close()
+                if gzip_obj:
+                    gzip_obj.close()
 
     except Exception as e:
         shutil.rmtree(
-            StorageService.prepare_long_path(tmp_root),
+            tmp_root_long,
             onerror=handle_remove_readonly,
         )
+        shutil.rmtree(out_dir, ignore_errors=True)
         if progress_dict and task_id:
             sync_task_to_db(task_id)
         raise e
 
     shutil.rmtree(
-        StorageService.prepare_long_path(tmp_root),
+        tmp_root_long,
         onerror=handle_remove_readonly,
     )
 
@@ -670,35 +1787,40 @@ def mirror_items_to_local(
     task_id: str | None = None,
     filters: dict | None = None,
     processing_mode: str = "sequential",
+    max_workers: int | None = None,
 ) -> None:
 
     dest_root_long = StorageService.prepare_long_path(dest_root)
     StorageService.ensure_dir(dest_root_long)
 
-    check_status_pause_cancel(progress_dict, task_id)
+    with periodic_db_sync(task_id, DB_SYNC_INTERVAL):
+        check_status_pause_cancel(progress_dict, task_id)
 
-    if processing_mode == "concurrent":
-         update_progress(task_id, {
-            "phase": "mapeando",
-            "message": "Espelho Turbo...",
-            "files_total": 0,
-            "bytes_found": 0,
-            "bytes_downloaded": 0,
-        })
-         execute_concurrent_download(
-            creds, items, dest_root, progress_dict, task_id, filters
-        )
-    else:
-        service_main = build("drive", "v3", credentials=creds)
-        files_list = build_files_list_for_items(
-            service_main, items, creds=creds, filters=filters, progress_dict=progress_dict, task_id=task_id
-        )
-        if not files_list:
-            raise Exception("Nenhum arquivo encontrado.")
+        if processing_mode == "concurrent":
+             update_progress(task_id, {
+                "phase": "mapeando",
+                "message": "Espelho Turbo...",
+                "files_total": 0,
+                "bytes_found": 0,
+                "bytes_downloaded": 0,
+            })
+             files_list = execute_concurrent_download(
+                creds, items, dest_root, progress_dict, task_id, filters, max_workers=max_workers
+            )
+             if not _files_found(files_list, progress_dict, task_id):
+                raise Exception("Nenhum arquivo encontrado.")
+        else:
+            service_main = get_thread_safe_service(creds)
+            files_list = build_files_list_for_items(
+                service_main, items, creds=creds, filters=filters, progress_dict=progress_dict, task_id=task_id
+            )
+            if not files_list:
+                raise Exception("Nenhum arquivo encontrado.")
 
-        download_files_to_folder(
-            creds, files_list, dest_root=dest_root, progress_dict=progress_dict, task_id=task_id, filters=filters, processing_mode=processing_mode
-        )
+            download_files_to_folder(
+                creds, files_list, dest_root=dest_root, progress_dict=progress_dict, task_id=task_id, filters=filters, processing_mode=processing_mode,
+                max_workers=max_workers,
+            )
 
     update_progress(task_id, {
         "phase": "concluido",
@@ -3,12 +3,23 @@ import os
 import time
 import threading
 import concurrent.futures
+import queue
 import random
+from collections import deque
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 
-from .drive import safe_name, file_passes_filters, extract_size_bytes
-from app.services.progress import sync_task_to_db, update_progress
+# orjson (opcional): parse das respostas do Drive em C, bem mais rápido que o
+# json da stdlib nas páginas de 1000 itens do files.list
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+from config import MAPPING_MAX_WORKERS
+from .drive import safe_name, active_filters, file_passes_filters, extract_size_bytes
+from app.services.progress import TaskCancelled, get_task_events, sync_task_to_db, update_progress
 
 # Lock para operações globais (como atualizar progresso compartilhado)
 _lock = threading.Lock()
@@ -18,18 +29,64 @@ _lock = threading.Lock()
 _thread_local = threading.local()
 
 # Configuração de alta performance
-MAX_MAPPING_WORKERS = 150
+MAX_MAPPING_WORKERS = max(1, MAPPING_MAX_WORKERS)
+
+# Janela adaptativa (AIMD) de lotes de pastas em voo no mapeamento: começa no
+# máximo, cai pela metade quando aparece rate limit e sobe MAPPING_STEP depois
+# de MAPPING_QUIET_PERIOD sem nenhum.
+MAPPING_MIN_WORKERS = 4
+MAPPING_STEP = 8
+MAPPING_CUT_INTERVAL = 1.0  # segundos; uma rajada de 429 corta uma vez só
+MAPPING_QUIET_PERIOD = 5.0  # segundos
 RETRY_LIMIT = 8
 
+# Pastas por consulta em list_children_many (o q do Drive tem limite de tamanho)
+FOLDERS_PER_LIST_QUERY = 50
+
+# Requisições por batch HTTP (limite do Drive é 100)
+FILES_PER_BATCH_REQUEST = 100
+
+# Cache id -> pai usado pelo get_ancestors_path (a UI resolve o caminho a cada
+# clique e os ancestrais se repetem). Entradas expiram para refletir movimentações.
+# A chave inclui a conta: o que uma conta enxerga acima de uma pasta
+# compartilhada não pode vazar para o caminho montado para outra.
+PARENTS_CACHE_TTL = 300.0  # segundos
+PARENTS_CACHE_MAX = 20000
+_parents_cache: dict[tuple, tuple[str | None, float]] = {}
+_parents_cache_lock = threading.Lock()
+
+
+class _OrjsonModel(JsonModel):
+    """JsonModel do googleapiclient com o corpo decodificado pelo orjson."""
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Mesmo comportamento do JsonModel: corpo que não é JSON volta como veio
+            return content.decode("utf-8") if isinstance(content, bytes) else content
+        if self._data_wrapper and "data" in body:
+            body = body["data"]
+        return body
+
+
+def build_drive_service(creds):
+    """Service Drive v3 com o discovery embutido na lib e, se houver, orjson."""
+    return build(
+        "drive", "v3", credentials=creds, cache_discovery=False, static_discovery=True,
+        model=_OrjsonModel() if orjson is not None else None,
+    )
+
 
 def get_thread_safe_service(creds):
     """
     Retorna uma instância do serviço Drive reutilizável para a thread atual.
     Isso aumenta drasticamente a velocidade do mapeamento.
     """
-    if not hasattr(_thread_local, "service"):
-        # Cria o serviço apenas se esta thread ainda não tiver um
-        _thread_local.service = build("drive", "v3", credentials=creds, cache_discovery=False)
+    if getattr(_thread_local, "creds", None) is not creds:
+        # Cria o serviço apenas se esta thread ainda não tiver um para essas credenciais
+        _thread_local.service = build_drive_service(creds)
+        _thread_local.creds = creds
     return _thread_local.service
 
 
@@ -40,32 +97,86 @@ def check_status_pause_cancel(progress_dict, task_id):
     if not progress_dict or not task_id:
         return
 
-    while True:
-        info = progress_dict.get(task_id, {})
-        if info.get("canceled"):
-            raise Exception("Cancelado pelo usuário")
+    # Pausa = run_event limpo: a thread bloqueia sem polling e retoma na hora
+    cancel_event, run_event = get_task_events(task_id)
+    if not run_event.is_set():
+        run_event.wait()
+    if cancel_event.is_set():
+        raise TaskCancelled()
+
+
+# Prazo (time.monotonic) até o qual ninguém chama a API depois de um rate
+# limit: quem levou o 429 segura também as outras threads (mapeamento, árvore
+# e downloads), que senão continuariam batendo na cota e voltariam todas
+# juntas no mesmo instante.
+_rate_limit_until = 0.0
+
+# Quantos rate limits já apareceram; a janela do mapeamento só olha se mudou
+_throttle_count = 0
+
+# 403 que são rate limit (vale esperar); os demais 403 (permissão etc.) falham na hora
+RATE_LIMIT_REASONS = frozenset({
+    "rateLimitExceeded", "userRateLimitExceeded", "sharingRateLimitExceeded",
+})
+
+
+def http_error_reason(err: HttpError) -> str:
+    """Retorna o 'reason' do primeiro erro detalhado da resposta (ou '')."""
+    details = getattr(err, "error_details", None)
+    if isinstance(details, list):
+        for d in details:
+            if isinstance(d, dict) and d.get("reason"):
+                return d["reason"]
+    return ""
+
+
+def is_rate_limit_error(err) -> bool:
+    """429, ou 403 cujo reason é de cota (não permissão/arquivo inacessível)."""
+    status = getattr(getattr(err, "resp", None), "status", None)
+    if status == 429:
+        return True
+    return status == 403 and http_error_reason(err) in RATE_LIMIT_REASONS
+
+
+def _note_throttle():
+    global _throttle_count
+    _throttle_count += 1
+
+
+def mark_rate_limited(seconds: float):
+    """Segura todos os workers (não só quem levou o rate limit) pelo tempo indicado."""
+    global _rate_limit_until
+    _note_throttle()
+    deadline = time.monotonic() + seconds
+    if deadline > _rate_limit_until:
+        _rate_limit_until = deadline
 
-        if info.get("paused"):
-            time.sleep(1)
-            continue
-        break
+
+def wait_rate_limit_cooldown():
+    remaining = _rate_limit_until - time.monotonic()
+    if remaining > 0:
+        # Jitter para as threads não dispararem em fase quando o prazo acaba
+        time.sleep(remaining + random.uniform(0, 1))
 
 
 def exponential_backoff(func):
-    """Decorador para tentar novamente em caso de Rate Limit (403/429/5xx)."""
+    """Decorador para tentar novamente em caso de Rate Limit (429/403 de cota) ou 5xx."""
     def wrapper(*args, **kwargs):
         delay = 1
         for i in range(RETRY_LIMIT):
+            wait_rate_limit_cooldown()
             try:
                 return func(*args, **kwargs)
             except HttpError as e:
-                # 403/429: Rate Limit, 5xx: Server Error
-                if e.resp.status in [403, 429, 500, 502, 503]:
+                rate_limited = is_rate_limit_error(e)
+                # Outros 403 (sem permissão, arquivo inacessível) falham na hora
+                if rate_limited or e.resp.status in (500, 502, 503):
                     if i == RETRY_LIMIT - 1:
                         raise e
                     # Jitter para evitar que todas as threads tentem no mesmo milissegundo
                     sleep_time = delay + random.uniform(0, 1)
-                    # print(f"Rate Limit ({e.resp.status}). Thread esperando {sleep_time:.2f}s...")
+                    if rate_limited:
+                        mark_rate_limited(delay)
                     time.sleep(sleep_time)
                     delay *= 2  # Backoff exponencial
                 else:
@@ -97,66 +208,141 @@ def list_children(service, folder_id, include_files: bool = False) -> list[dict]
       - mimeType
       - modified_time (string ISO)
     """
-    query = f"'{folder_id}' in parents and trashed = false"
-    fields = "files(id, name, mimeType, size, modifiedTime), nextPageToken"
+    query = f"'{folder_id}' in parents and trashed = false" + _tree_query_suffix(include_files)
+    fields = _tree_list_fields(include_files)
 
     items: list[dict] = []
-    page_token = None
-
-    while True:
-        resp = (
-            service.files()
-            .list(
-                q=query,
-                fields=fields,
-                pageToken=page_token,
-                pageSize=1000,
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True,
-            )
-            .execute()
-        )
+    files_api = service.files()
+    req = files_api.list(
+        q=query,
+        fields=fields,
+        pageSize=1000,
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True,
+    )
+
+    # list_next monta a próxima página a partir do nextPageToken (None no fim)
+    while req is not None:
+        resp = safe_list_execute(req)
 
         for f in resp.get("files", []):
-            mime = f.get("mimeType")
-            modified = f.get("modifiedTime")
-            is_folder = mime == "application/vnd.google-apps.folder"
-
-            if is_folder:
-                items.append(
-                    {
-                        "id": f["id"],
-                        "name": f["name"],
-                        "type": "folder",
-                        "mimeType": mime,
-                        "modified_time": modified,
-                    }
-                )
-            elif include_files:
-                size = int(f.get("size") or 0)
-                items.append(
-                    {
-                        "id": f["id"],
-                        "name": f["name"],
-                        "type": "file",
-                        "size_bytes": size,
-                        "mimeType": mime,
-                        "modified_time": modified,
-                    }
-                )
+            item = _to_tree_item(f, include_files)
+            if item:
+                items.append(item)
 
-        page_token = resp.get("nextPageToken")
-        if not page_token:
-            break
+        req = files_api.list_next(req, resp)
 
     # Pastas primeiro, depois arquivos, em ordem alfabética
-    items.sort(key=lambda x: (x["type"] != "folder", x["name"].lower()))
+    items.sort(key=_tree_sort_key)
     return items
 
 
+def _to_tree_item(f: dict, include_files: bool) -> dict | None:
+    """Converte um item do files.list no formato da árvore (None se for ignorado)."""
+    mime = f.get("mimeType")
+    modified = f.get("modifiedTime")
+    is_folder = mime == "application/vnd.google-apps.folder"
+
+    if is_folder:
+        return {
+            "id": f["id"],
+            "name": f["name"],
+            "type": "folder",
+            "mimeType": mime,
+            "modified_time": modified,
+        }
+    if include_files:
+        size = int(f.get("size") or 0)
+        item = {
+            "id": f["id"],
+            "name": f["name"],
+            "type": "file",
+            "size_bytes": size,
+            "mimeType": mime,
+            "modified_time": modified,
+        }
+        # Atalho: o alvo já vem na listagem, o download não precisa buscá-lo
+        target = (f.get("shortcutDetails") or {}).get("targetId")
+        if target:
+            item["shortcutTargetId"] = target
+        return item
+    return None
+
+
+def _tree_query_suffix(include_files: bool) -> str:
+    """Árvore só de pastas: o filtro vai na consulta, os arquivos nem chegam."""
+    return "" if include_files else " and mimeType = 'application/vnd.google-apps.folder'"
+
+
+def _tree_list_fields(include_files: bool, with_parents: bool = False) -> str:
+    """Campos do files.list da árvore; tamanho e atalho só interessam a arquivos."""
+    extra = ", size, shortcutDetails(targetId)" if include_files else ""
+    parents = ", parents" if with_parents else ""
+    return f"files(id, name, mimeType, modifiedTime{parents}{extra}), nextPageToken"
+
+
+def _tree_sort_key(item: dict):
+    # sort(key=...) já calcula a chave uma vez por item (decorate-sort-undecorate);
+    # casefold compara sem caixa também fora do ASCII (ß, ligaduras)
+    return (item["type"] != "folder", item["name"].casefold())
+
+
+def list_children_many(service, folder_ids: list[str], include_files: bool = False) -> dict[str, list[dict]]:
+    """
+    Lista os filhos diretos de várias pastas com uma única consulta paginada
+    ('a' in parents or 'b' in parents ...), em vez de uma chamada por pasta.
+    Retorna {folder_id: [itens]} no mesmo formato/ordem de list_children.
+    """
+    result: dict[str, list[dict]] = {fid: [] for fid in folder_ids}
+    fields = _tree_list_fields(include_files, with_parents=True)
+
+    for start in range(0, len(folder_ids), FOLDERS_PER_LIST_QUERY):
+        chunk = folder_ids[start:start + FOLDERS_PER_LIST_QUERY]
+        parents_q = " or ".join(f"'{fid}' in parents" for fid in chunk)
+        query = f"({parents_q}) and trashed = false" + _tree_query_suffix(include_files)
+        files_api = service.files()
+        req = files_api.list(
+            q=query,
+            fields=fields,
+            pageSize=1000,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+        )
+
+        while req is not None:
+            resp = safe_list_execute(req)
+
+            for f in resp.get("files", []):
+                item = _to_tree_item(f, include_files)
+                if not item:
+                    continue
+                for parent in f.get("parents") or []:
+                    if parent in result:
+                        result[parent].append(item)
+
+            req = files_api.list_next(req, resp)
+
+    for items in result.values():
+        items.sort(key=_tree_sort_key)
+    return result
+
+
 def get_children(creds, parent_id: str, include_files: bool):
     service = get_thread_safe_service(creds) # Usa a versão otimizada
-    return list_children(service, parent_id, include_files)
+    children = list_children(service, parent_id, include_files)
+    # Quem a UI acabou de listar é quem ela vai pedir o caminho depois
+    _remember_parents(creds, ((c["id"], parent_id) for c in children))
+    return children
+
+
+def get_children_many(creds, parent_ids: list[str], include_files: bool):
+    service = get_thread_safe_service(creds)
+    result = list_children_many(service, parent_ids, include_files)
+    _remember_parents(
+        creds,
+        ((c["id"], parent_id) for parent_id, children in result.items() for c in children),
+    )
+    return result
 
 
 def get_file_metadata(creds, file_id: str) -> dict:
@@ -169,8 +355,93 @@ def get_file_metadata(creds, file_id: str) -> dict:
     return meta
 
 
+def get_files_metadata_many(service, file_ids: list[str], fields: str) -> dict[str, dict]:
+    """
+    Busca os metadados de vários arquivos com batch HTTP (até
+    FILES_PER_BATCH_REQUEST por ida ao servidor), em vez de um files().get
+    por arquivo. Retorna {file_id: meta}.
+    Itens que voltam com rate limit/5xx vão juntos para um novo batch após o
+    backoff; o que falhar de outro jeito é refeito individualmente e, se
+    falhar de novo, fica de fora do resultado.
+    """
+    pending = list(dict.fromkeys(file_ids))  # request_id precisa ser único no batch
+    result: dict[str, dict] = {}
+    failed: list[str] = []
+
+    for attempt in range(RETRY_LIMIT):
+        if not pending:
+            break
+        throttled: list[str] = []
+
+        def _on_meta(request_id, response, exception):
+            if exception is None:
+                result[request_id] = response
+            elif (is_rate_limit_error(exception)
+                    or getattr(getattr(exception, "resp", None), "status", None) in (500, 502, 503)):
+                throttled.append(request_id)
+            else:
+                failed.append(request_id)
+
+        for start in range(0, len(pending), FILES_PER_BATCH_REQUEST):
+            chunk = pending[start:start + FILES_PER_BATCH_REQUEST]
+            batch = service.new_batch_http_request(callback=_on_meta)
+            for fid in chunk:
+                batch.add(
+                    service.files().get(fileId=fid, fields=fields, supportsAllDrives=True),
+                    request_id=fid,
+                )
+            try:
+                batch.execute()
+            except Exception:
+                throttled.extend(fid for fid in chunk if fid not in result)
+
+        pending = throttled
+        if pending and attempt + 1 < RETRY_LIMIT:
+            time.sleep(min(32, 2 ** attempt) * 0.5 + random.uniform(0, 1))
+
+    for fid in failed + pending:
+        try:
+            result[fid] = safe_list_execute(
+                service.files().get(fileId=fid, fields=fields, supportsAllDrives=True)
+            )
+        except Exception:
+            pass
+
+    return result
+
+
+def creds_key(creds):
+    """
+    Identifica a conta das credenciais. O objeto Credentials é recriado a cada
+    requisição, então id() não serve; o refresh token é estável por conta.
+    """
+    return getattr(creds, "refresh_token", None) or id(creds)
+
+
+def _cached_parent(creds, file_id: str):
+    """Retorna (achou, pai) do cache, descartando entradas vencidas."""
+    entry = _parents_cache.get((creds_key(creds), file_id))
+    if entry is None:
+        return False, None
+    parent, expires = entry
+    if expires < time.monotonic():
+        return False, None
+    return True, parent
+
+
+def _remember_parents(creds, pairs):
+    """Guarda pares (id, pai) da conta no cache de ancestrais."""
+    key = creds_key(creds)
+    expires = time.monotonic() + PARENTS_CACHE_TTL
+    with _parents_cache_lock:
+        if len(_parents_cache) > PARENTS_CACHE_MAX:
+            _parents_cache.clear()
+        for file_id, parent in pairs:
+            _parents_cache[(key, file_id)] = (parent, expires)
+
+
 def get_ancestors_path(creds, target_id: str) -> list:
-    service = get_thread_safe_service(creds)
+    service = None
     path_ids = []
     current_id = target_id
 
@@ -179,15 +450,22 @@ def get_ancestors_path(creds, target_id: str) -> list:
         path_ids.insert(0, current_id)
         if current_id == 'root': break
 
-        try:
-            req = service.files().get(fileId=current_id, fields="parents")
-            f = safe_list_execute(req)
-            parents = f.get('parents')
-            if parents: current_id = parents[0]
-            else: break
-        except Exception as e:
-            print(f"Erro ao resolver caminho para {current_id}: {e}")
-            break
+        found, parent = _cached_parent(creds, current_id)
+        if not found:
+            try:
+                if service is None:
+                    service = get_thread_safe_service(creds)
+                req = service.files().get(fileId=current_id, fields="parents")
+                f = safe_list_execute(req)
+                parents = f.get('parents')
+                parent = parents[0] if parents else None
+                _remember_parents(creds, [(current_id, parent)])
+            except Exception as e:
+                print(f"Erro ao resolver caminho para {current_id}: {e}")
+                break
+
+        if parent: current_id = parent
+        else: break
 
     return path_ids
 
@@ -196,76 +474,216 @@ def get_ancestors_path(creds, target_id: str) -> list:
 # WORKER OTIMIZADO PARA MAPEAMENTO
 # ---------------------------------------------------------------------------
 
-def _worker_process_folder(
+def _folder_list_fields(filters) -> str:
+    """
+    Campos do files.list do mapeamento: só o que vira item da lista de
+    download, mais as datas quando algum filtro de data precisa delas.
+    """
+    extra = ""
+    if filters and filters.get("created_after"):
+        extra += "createdTime, "
+    if filters and filters.get("modified_after"):
+        extra += "modifiedTime, "
+    return (
+        "nextPageToken, "
+        f"files(id, name, mimeType, {extra}size, parents, shortcutDetails(targetId))"
+    )
+
+
+_FOLDER_MIME = "application/vnd.google-apps.folder"
+_SHORTCUT_MIME = "application/vnd.google-apps.shortcut"
+
+
+def _collect_folder_page(files, base_path, filters, local_files, subfolders_to_scan) -> int:
+    """
+    Separa uma página do files.list em arquivos (já filtrados) e subpastas.
+    Retorna a soma dos tamanhos dos arquivos aceitos.
+    """
+    # Roda uma vez por item listado: o que não muda dentro da página fica
+    # fora do loop (prefixo do caminho, funções em variáveis locais)
+    prefix = base_path + os.sep
+    clean = safe_name  # lru_cache: nomes repetidos não passam de novo pela regex
+    size_of = extract_size_bytes
+    add_folder = subfolders_to_scan.append
+    add_file = local_files.append
+
+    page_bytes = 0
+    for f in files:
+        mime = f["mimeType"]
+
+        if mime == _FOLDER_MIME:
+            # Achou pasta: prepara para a próxima iteração do "Divide and Conquer"
+            add_folder((f["id"], prefix + clean(f["name"])))
+            continue
+
+        # Achou arquivo: verifica filtro e adiciona
+        if filters and not file_passes_filters(f, filters):
+            continue
+
+        name = f["name"]
+        size_bytes = size_of(f)
+        file_obj = {
+            "id": f["id"],
+            "name": name,
+            "mimeType": mime,
+            "rel_path": prefix + clean(name),
+            "size_bytes": size_bytes,
+        }
+        if mime == _SHORTCUT_MIME:
+            target = (f.get("shortcutDetails") or {}).get("targetId")
+            if target:
+                file_obj["shortcutTargetId"] = target
+        add_file(file_obj)
+        page_bytes += size_bytes
+
+    return page_bytes
+
+
+def _worker_process_folders(
     creds,
-    folder_id,
-    base_path,
+    folders,
     filters,
     progress_dict,
     task_id,
 ):
     """
-    Worker executado por thread.
+    Worker executado por thread: lista um grupo de pastas (folder_id, base_path).
+    Cada files.list cobre até FOLDERS_PER_LIST_QUERY pastas ('a' in parents or
+    'b' in parents ...) e até FILES_PER_BATCH_REQUEST listagens vão juntas num
+    batch HTTP. Listagens com mais de uma página voltam para a próxima rodada
+    com o pageToken.
     Usa 'get_thread_safe_service' para não recriar conexão SSL a cada chamada.
     """
     service = get_thread_safe_service(creds)
+    fields = _folder_list_fields(filters)
 
     local_files = []
     subfolders_to_scan = []
-    page_token = None
-
-    while True:
-        # Verifica pausa a cada página para ser responsivo
+    local_bytes = 0
+    # ({folder_id: base_path}, page_token, tentativas)
+    pending = [
+        (dict(folders[i:i + FOLDERS_PER_LIST_QUERY]), None, 0)
+        for i in range(0, len(folders), FOLDERS_PER_LIST_QUERY)
+    ]
+
+    while pending:
+        # Verifica pausa a cada rodada para ser responsivo
         check_status_pause_cancel(progress_dict, task_id)
 
-        try:
+        wave = pending[:FILES_PER_BATCH_REQUEST]
+        pending = pending[FILES_PER_BATCH_REQUEST:]
+        retry = []
+        # Listagens que já tiveram resposta (se o batch cair no meio, só as
+        # demais voltam para a fila; refazer as outras duplicaria arquivos)
+        answered = set()
+
+        def _on_list(request_id, response, exception):
+            nonlocal local_bytes
+            answered.add(int(request_id))
+            paths, token, attempts = wave[int(request_id)]
+            if exception is not None:
+                status = getattr(getattr(exception, "resp", None), "status", None)
+                # Só 429/403 de cota contam como throttle; 403 de permissão não se repete
+                rate_limited = is_rate_limit_error(exception)
+                if rate_limited:
+                    _note_throttle()
+                if (rate_limited or status in (500, 502, 503)) and attempts + 1 < RETRY_LIMIT:
+                    retry.append((paths, token, attempts + 1))
+                else:
+                    names = ", ".join(list(paths.values())[:3])
+                    update_progress(task_id, {"history": [f"ERRO ao ler pasta {names}: {exception}"]})
+                return
+
+            # Reagrupa a página por pasta de origem para montar os caminhos
+            by_parent: dict[str, list] = {}
+            for f in response.get("files", []):
+                for parent in f.get("parents") or []:
+                    if parent in paths:
+                        by_parent.setdefault(parent, []).append(f)
+            for parent, files in by_parent.items():
+                local_bytes += _collect_folder_page(
+                    files, paths[parent], filters, local_files, subfolders_to_scan
+                )
+
+            next_token = response.get("nextPageToken")
+            if next_token:
+                pending.append((paths, next_token, 0))
+
+        batch = service.new_batch_http_request(callback=_on_list)
+        for idx, (paths, token, _attempts) in enumerate(wave):
+            parents_q = " or ".join(f"'{fid}' in parents" for fid in paths)
             # Solicita apenas os campos essenciais para performance
-            req = service.files().list(
-                q=f"'{folder_id}' in parents and trashed = false",
-                fields="nextPageToken, files(id, name, mimeType, createdTime, modifiedTime, size)",
-                pageToken=page_token,
-                pageSize=1000, # Máximo permitido
-                spaces="drive",
+            batch.add(
+                service.files().list(
+                    q=f"({parents_q}) and trashed = false",
+                    fields=fields,
+                    pageToken=token,
+                    pageSize=1000,  # Máximo permitido
+                    spaces="drive",
+                    # Pastas de drives compartilhados (selecionáveis na árvore)
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True,
+                ),
+                request_id=str(idx),
             )
-            results = safe_list_execute(req)
+        try:
+            safe_list_execute(batch)
         except Exception as e:
-            update_progress(task_id, {"history": [f"ERRO ao ler pasta {base_path}: {e}"]})
-            # Em caso de erro na pasta, retorna o que achou até agora
-            return local_files, subfolders_to_scan
-
-        files = results.get("files", [])
-
-        # Processamento em memória é rápido, o gargalo é a API
-        for f in files:
-            file_id = f["id"]
-            name = f["name"]
-            mime = f["mimeType"]
-
-            if mime == "application/vnd.google-apps.folder":
-                # Achou pasta: prepara para a próxima iteração do "Divide and Conquer"
-                new_base = os.path.join(base_path, safe_name(name))
-                subfolders_to_scan.append((file_id, new_base))
-            else:
-                # Achou arquivo: verifica filtro e adiciona
-                if not file_passes_filters(f, filters):
+            # Falha do batch inteiro (rede, 5xx após os retries): as listagens
+            # sem resposta voltam para a fila com mais uma tentativa
+            lost = []
+            for idx, (paths, token, attempts) in enumerate(wave):
+                if idx in answered:
                     continue
+                if attempts + 1 < RETRY_LIMIT:
+                    retry.append((paths, token, attempts + 1))
+                else:
+                    lost.append(paths)
+            if lost:
+                names = ", ".join(p for paths in lost[:3] for p in list(paths.values())[:1])
+                update_progress(task_id, {"history": [f"ERRO ao ler pastas ({names}...): {e}"]})
 
-                rel_path = os.path.join(base_path, safe_name(name))
-                size_bytes = extract_size_bytes(f)
+        if retry:
+            # Rate limit em parte do batch: espera com jitter e tenta de novo só essas
+            time.sleep(2 ** max(r[2] for r in retry) * 0.5 + random.uniform(0, 1))
+            pending.extend(retry)
 
-                local_files.append({
-                    "id": file_id,
-                    "name": name,
-                    "mimeType": mime,
-                    "rel_path": rel_path,
-                    "size_bytes": size_bytes,
-                })
+    return local_files, subfolders_to_scan, local_bytes
 
-        page_token = results.get("nextPageToken")
-        if not page_token:
-            break
 
-    return local_files, subfolders_to_scan
+class _MappingWindow:
+    """
+    Limite de lotes de pastas em voo (AIMD). Só a thread principal do
+    mapeamento mexe nele; os workers apenas contam os rate limits.
+    """
+
+    def __init__(self):
+        self.limit = MAX_MAPPING_WORKERS
+        self._seen = _throttle_count
+        self._last_change = time.monotonic()
+        self._last_throttle = float("-inf")
+
+    def adjust(self):
+        now = time.monotonic()
+        if _throttle_count != self._seen:
+            self._seen = _throttle_count
+            self._last_throttle = now
+            if now - self._last_change >= MAPPING_CUT_INTERVAL:
+                self.limit = max(min(MAPPING_MIN_WORKERS, MAX_MAPPING_WORKERS), self.limit // 2)
+                self._last_change = now
+        elif (self.limit < MAX_MAPPING_WORKERS
+                and now - self._last_change >= MAPPING_QUIET_PERIOD
+                and now - self._last_throttle >= MAPPING_QUIET_PERIOD):
+            self.limit = min(MAX_MAPPING_WORKERS, self.limit + MAPPING_STEP)
+            self._last_change = now
+
+
+def _add_mapping_progress(info: dict, files: int, nbytes: int):
+    with _lock:
+        count_now = info.get("files_found", 0) + files
+        info["files_found"] = count_now
+        info["bytes_found"] = info.get("bytes_found", 0) + nbytes
+        info["message"] = f"Mapeando: {count_now} itens encontrados..."
 
 
 def build_files_list_for_items(
@@ -283,6 +701,8 @@ def build_files_list_for_items(
         raise ValueError("Credenciais não fornecidas.")
 
     all_files_list: list[dict] = []
+    # Sem restrição real (ex.: todos os tipos marcados), os workers nem chamam o filtro
+    filters = active_filters(filters)
 
     # Inicializa thread_local para a thread principal também, se necessário
     if not hasattr(_thread_local, "service"):
@@ -301,7 +721,18 @@ def build_files_list_for_items(
         sync_task_to_db(task_id)
 
     initial_folders = []
-    changes_since_sync = 0
+    # Contadores acumulados localmente e aplicados no progresso de uma vez;
+    # o banco é sincronizado pelo periodic_db_sync de quem chama
+    pending_files = 0
+    pending_bytes = 0
+    total_bytes = 0
+
+    # Metadados dos arquivos raiz de uma vez só (batch HTTP)
+    root_file_ids = [it.get("id") for it in items if it.get("type", "file") != "folder"]
+    root_meta = get_files_metadata_many(
+        service_main, root_file_ids,
+        "id, name, mimeType, createdTime, modifiedTime, size, shortcutDetails(targetId)",
+    ) if root_file_ids else {}
 
     # 1. Processa itens raiz (Nível 0)
     for it in items:
@@ -317,14 +748,11 @@ def build_files_list_for_items(
         else:
             # Processa arquivos raiz
             try:
-                # Usa método seguro que já tem retry
-                req = service_main.files().get(
-                    fileId=it_id,
-                    fields="id, name, mimeType, createdTime, modifiedTime, size",
-                )
-                meta = safe_list_execute(req)
+                meta = root_meta.get(it_id)
+                if meta is None:
+                    raise Exception("metadados indisponíveis")
 
-                if file_passes_filters(meta, filters):
+                if not filters or file_passes_filters(meta, filters):
                     fname = meta["name"]
                     mime = meta["mimeType"]
                     size_bytes = extract_size_bytes(meta)
@@ -337,103 +765,116 @@ def build_files_list_for_items(
                         "rel_path": rel_path,
                         "size_bytes": size_bytes,
                     }
+                    target = (meta.get("shortcutDetails") or {}).get("targetId")
+                    if target:
+                        obj["shortcutTargetId"] = target
                     all_files_list.append(obj)
-
-                    with _lock:
-                        if progress_dict and task_id:
-                            info = progress_dict[task_id]
-                            info["files_found"] = info.get("files_found", 0) + 1
-                            info["bytes_found"] = info.get("bytes_found", 0) + size_bytes
-                            info["message"] = f"Mapeando: {info['files_found']} itens..."
-                            progress_dict[task_id] = info
-                            changes_since_sync += 1
-
-                    if changes_since_sync >= 50:
-                        sync_task_to_db(task_id)
-                        changes_since_sync = 0
+                    pending_files += 1
+                    pending_bytes += size_bytes
+                    total_bytes += size_bytes
 
             except Exception as e:
                 print(f"Erro item raiz {it_name}: {e}")
 
+    if pending_files and progress_dict and task_id:
+        _add_mapping_progress(progress_dict[task_id], pending_files, pending_bytes)
+    pending_files = pending_bytes = 0
+
     # 2. Processa Subpastas (Dividir para Conquistar com ThreadPool)
-    # O segredo aqui é que cada thread reutiliza sua própria conexão
+    # Cada tarefa lista um grupo de pastas num batch HTTP; a fronteira é
+    # repartida entre os slots livres para manter todas as threads ocupadas
+    frontier = deque(initial_folders)
     with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_MAPPING_WORKERS) as executor:
         future_to_folder = {}
-
-        # "Semeia" o executor com as pastas iniciais
-        for fid, fpath in initial_folders:
-            f = executor.submit(
-                _worker_process_folder, creds, fid, fpath, filters, progress_dict, task_id
-            )
-            future_to_folder[f] = fpath
+        # Cada future se coloca aqui ao terminar: o loop acorda com um get()
+        # em vez de reinstalar waiters em todos os futures pendentes (wait)
+        completed = queue.SimpleQueue()
+        window = _MappingWindow()
 
         # Loop principal de consumo
-        while future_to_folder:
+        while frontier or future_to_folder:
             check_status_pause_cancel(progress_dict, task_id)
 
-            # Espera a primeira tarefa terminar para manter o fluxo constante
-            done, _ = concurrent.futures.wait(
-                future_to_folder.keys(),
-                return_when=concurrent.futures.FIRST_COMPLETED,
-            )
+            if not future_to_folder and len(frontier) == 1:
+                # Só uma pasta e nada em voo (raiz única, cadeia de subpastas):
+                # lista aqui mesmo, sem passar pelo pool
+                group = [frontier.popleft()]
+                f = concurrent.futures.Future()
+                try:
+                    f.set_result(_worker_process_folders(creds, group, filters, progress_dict, task_id))
+                except Exception as e:
+                    f.set_exception(e)
+                future_to_folder[f] = group
+                completed.put(f)
+
+            while frontier and len(future_to_folder) < window.limit:
+                free_slots = window.limit - len(future_to_folder)
+                size = min(
+                    FILES_PER_BATCH_REQUEST * FOLDERS_PER_LIST_QUERY,
+                    -(-len(frontier) // free_slots),
+                )
+                group = [frontier.popleft() for _ in range(size)]
+                f = executor.submit(
+                    _worker_process_folders, creds, group, filters, progress_dict, task_id
+                )
+                future_to_folder[f] = group
+                f.add_done_callback(completed.put)
+
+            # Espera a primeira tarefa terminar e pega as que já acabaram junto
+            done = [completed.get()]
+            while True:
+                try:
+                    done.append(completed.get_nowait())
+                except queue.Empty:
+                    break
 
             for future in done:
-                fpath_orig = future_to_folder.pop(future)
+                group = future_to_folder.pop(future)
+                fpath_orig = group[0][1] if len(group) == 1 else f"{len(group)} pastas"
 
                 try:
-                    found_files, found_subfolders = future.result()
+                    found_files, found_subfolders, found_bytes = future.result()
 
                     # 1. Adiciona Arquivos encontrados (RESULTADO)
+                    # (só esta thread consome os resultados: não precisa de lock)
                     if found_files:
-                        with _lock:
-                            all_files_list.extend(found_files)
-
-                            if progress_dict and task_id:
-                                info = progress_dict[task_id]
-                                count_now = info.get("files_found", 0) + len(found_files)
-                                info["files_found"] = count_now
-
-                                total_bytes = sum(x["size_bytes"] for x in found_files)
-                                info["bytes_found"] = info.get("bytes_found", 0) + total_bytes
-                                info["message"] = f"Mapeando: {count_now} itens encontrados..."
-
-                                # Log inteligente (não logar tudo para não travar UI)
-                                hist = info.get("history", [])
-                                if len(found_files) < 3:
-                                    for ff in found_files:
-                                        hist.append(f"Mapeado: {ff['rel_path']}")
-                                else:
-                                    hist.append(f"Mapeados +{len(found_files)} arquivos em {fpath_orig}")
-                                info["history"] = hist
-
-                                progress_dict[task_id] = info
-                                changes_since_sync += 1
-
-                        if progress_dict and task_id and changes_since_sync >= 100:
-                            sync_task_to_db(task_id)
-                            changes_since_sync = 0
-
-                    # 2. Divide para Conquistar: Submete novas pastas IMEDIATAMENTE
-                    # Isso garante que os workers nunca fiquem ociosos se houver profundidade
-                    for sub_id, sub_path in found_subfolders:
-                        new_future = executor.submit(
-                            _worker_process_folder, creds, sub_id, sub_path, filters, progress_dict, task_id
-                        )
-                        future_to_folder[new_future] = sub_path
+                        all_files_list.extend(found_files)
+                        pending_files += len(found_files)
+                        pending_bytes += found_bytes
+                        total_bytes += found_bytes
 
+                        # Log inteligente (não logar tudo para não travar UI);
+                        # o histórico é um deque, o append não precisa do lock
+                        if progress_dict and task_id:
+                            hist = progress_dict[task_id]["history"]
+                            if len(found_files) < 3:
+                                for ff in found_files:
+                                    hist.append(f"Mapeado: {ff['rel_path']}")
+                            else:
+                                hist.append(f"Mapeados +{len(found_files)} arquivos em {fpath_orig}")
+
+                    # 2. Divide para Conquistar: as novas pastas entram na fronteira
+                    # e são submetidas já na próxima volta do loop
+                    frontier.extend(found_subfolders)
+
+                except TaskCancelled:
+                    for pending in future_to_folder:
+                        pending.cancel()
+                    raise
                 except Exception as exc:
-                    err_msg = str(exc)
-                    if "Cancelado" in err_msg:
-                        for pending in future_to_folder:
-                            pending.cancel()
-                        raise exc
-
                     print(f"Erro no worker de mapeamento para {fpath_orig}: {exc}")
                     update_progress(task_id, {"history": [f"ERRO pasta {fpath_orig}: {exc}"]})
 
+            # Rate limit na rodada reduz os lotes em voo; rodadas limpas devolvem
+            window.adjust()
+
+            # Um lock por rodada de futures concluídos, não um por pasta
+            if pending_files and progress_dict and task_id:
+                _add_mapping_progress(progress_dict[task_id], pending_files, pending_bytes)
+                pending_files = pending_bytes = 0
+
     # Finalização
     if progress_dict is not None and task_id is not None:
-        total_bytes = sum(f.get("size_bytes", 0) for f in all_files_list)
         mb = total_bytes / (1024 * 1024) if total_bytes else 0
         update_progress(task_id, {
             "files_total": len(all_files_list),
@@ -466,7 +907,8 @@ def calculate_selection_stats(creds, items):
         "is_partial": False  # Flag para avisar o front que parou no meio
     }
 
-    stack = []
+    # Fila (BFS): deque para o popleft ser O(1) em pastas muito largas
+    stack = deque()
 
     # 1. Processa seleção inicial
     for item in items:
@@ -491,7 +933,7 @@ def calculate_selection_stats(creds, items):
             stats["is_partial"] = True
             break  # <--- PARA O LOOP AQUI
 
-        parent_id = stack.pop(0)
+        parent_id = stack.popleft()
         page_token = None
 
         while True:
@@ -506,7 +948,9 @@ def calculate_selection_stats(creds, items):
                     q=f"'{parent_id}' in parents and trashed = false",
                     fields="nextPageToken, files(id, name, mimeType, size)",
                     pageToken=page_token,
-                    pageSize=1000
+                    pageSize=1000,
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True,
                 ).execute()
 
                 files = results.get("files", [])
@@ -533,70 +977,3 @@ def calculate_selection_stats(creds, items):
             break
 
     return stats
-    """
-    Calcula estatísticas (tamanho, contagem) dos itens selecionados
-    sem iniciar o download. Retorna JSON para o modal.
-    """
-    service = get_thread_safe_service(creds)
-
-    stats = {
-        "files_count": 0,
-        "folders_count": 0,
-        "total_size_bytes": 0,
-        "preview_files": [] # Lista com nomes dos primeiros 5 arquivos
-    }
-
-    # Fila para processar pastas
-    stack = []
-
-    # 1. Processa a seleção inicial
-    for item in items:
-        if item.get("type") == "folder":
-            stats["folders_count"] += 1
-            stack.append(item["id"])
-        else:
-            stats["files_count"] += 1
-            # Se já veio da árvore com tamanho, usa. Se não, assume 0 ou busca depois (aqui simplificado)
-            s = int(item.get("size_bytes", 0))
-            if s == 0 and item.get("size"): s = int(item["size"]) # Fallback
-            stats["total_size_bytes"] += s
-
-            if len(stats["preview_files"]) < 5:
-                stats["preview_files"].append(item["name"])
-
-    # 2. Varredura recursiva rápida (apenas metadados)
-    while stack:
-        parent_id = stack.pop(0)
-        page_token = None
-
-        while True:
-            try:
-                # Pede apenas campos leves
-                results = service.files().list(
-                    q=f"'{parent_id}' in parents and trashed = false",
-                    fields="nextPageToken, files(id, name, mimeType, size)",
-                    pageToken=page_token,
-                    pageSize=1000
-                ).execute()
-
-                files = results.get("files", [])
-
-                for f in files:
-                    if f["mimeType"] == "application/vnd.google-apps.folder":
-                        stats["folders_count"] += 1
-                        stack.append(f["id"])
-                    else:
-                        stats["files_count"] += 1
-                        stats["total_size_bytes"] += int(f.get("size", 0))
-
-                        if len(stats["preview_files"]) < 5:
-                            stats["preview_files"].append(f["name"])
-
-                page_token = results.get("nextPageToken")
-                if not page_token:
-                    break
-            except Exception as e:
-                print(f"Erro ao calcular stats da pasta {parent_id}: {e}")
-                break
-
-    return stats
@@ -1,13 +1,24 @@
 # services/auth_service.py
 import json
+import threading
+from datetime import datetime, timedelta, timezone
 
 from flask import session, url_for, has_request_context
 from google_auth_oauthlib.flow import Flow
+from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from app.models import db, GoogleAuthModel
 
 from config import CLIENT_SECRETS_FILE, SCOPES
 
+# Credentials já montadas por registro (id -> (token_json, creds)). Um objeto
+# só por conta: perto de vencer (CREDS_REFRESH_BUFFER), ele é renovado no
+# lugar e o token novo vai para o banco, em vez de remontar um Credentials
+# a partir do token_json (vencido) a cada get_credentials().
+CREDS_REFRESH_BUFFER = timedelta(seconds=300)
+_creds_cache: dict[int, tuple[str, Credentials]] = {}
+_creds_cache_lock = threading.Lock()
+
 # # Pasta/arquivo onde o token será salvo para uso pelos jobs agendados
 # AUTH_DIR = os.path.join(os.getcwd(), "storage", "auth")
 # TOKEN_PATH = os.path.join(AUTH_DIR, "token.json")
@@ -22,6 +33,8 @@ def credentials_to_dict(c: Credentials) -> dict:
         "client_id": c.client_id,
         "client_secret": c.client_secret,
         "scopes": c.scopes,
+        # Sem expiry, o google-auth trata o token carregado como vencido
+        "expiry": c.expiry.isoformat() + "Z" if c.expiry else None,
     }
 
 
@@ -91,9 +104,39 @@ def _load_credentials_from_db() -> Credentials | None:
     if not auth:
         return None
 
-    data = json.loads(auth.token_json)
-    # usa from_authorized_user_info porque temos um dict serializável
-    return Credentials.from_authorized_user_info(data, data.get("scopes"))
+    with _creds_cache_lock:
+        cached = _creds_cache.get(auth.id)
+        if cached and cached[0] == auth.token_json:
+            creds = cached[1]
+        else:
+            # Primeira leitura ou login novo (token_json trocado no banco)
+            data = json.loads(auth.token_json)
+            # usa from_authorized_user_info porque temos um dict serializável
+            creds = Credentials.from_authorized_user_info(data, data.get("scopes"))
+
+        token_json = auth.token_json
+        if not _token_still_fresh(creds) and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+                new_json = json.dumps(credentials_to_dict(creds))
+                auth.token_json = new_json
+                db.session.commit()
+                token_json = new_json
+            except Exception as e:
+                # Sem rede/OAuth agora: o googleapiclient tenta renovar no uso
+                print(f"Erro ao renovar credenciais: {e}")
+                db.session.rollback()
+
+        _creds_cache[auth.id] = (token_json, creds)
+    return creds
+
+
+def _token_still_fresh(creds: Credentials) -> bool:
+    """Access token válido por mais que CREDS_REFRESH_BUFFER (expiry é UTC sem tz)."""
+    if not creds.token or creds.expiry is None:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now > CREDS_REFRESH_BUFFER
 
 
 def get_credentials() -> Credentials | None:
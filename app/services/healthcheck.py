@@ -1,6 +1,7 @@
 # app/services/healthcheck.py
 import os
 import shutil
+import ssl
 import time
 import json
 from datetime import datetime, timedelta
@@ -21,6 +22,12 @@ from app.models.google_auth import GoogleAuthModel
 from app.models.backup_file import BackupFileModel
 from app.models.task import TaskModel
 
+# Backend DEFLATE acelerado (opcional) usado na compactação dos backups
+try:
+    import isal
+except ImportError:
+    isal = None
+
 try:
     from google.oauth2.credentials import Credentials
     from google.auth.transport.requests import Request
@@ -262,7 +269,63 @@ def check_disk_space() -> Dict[str, Any]:
 
 
 # ==========================================
-# 6. HISTÓRICO DE TAREFAS (FALHAS)
+# 6. TLS / CRIPTOGRAFIA (CPU por byte baixado)
+# ==========================================
+def _cpu_crypto_flags() -> Dict[str, bool]:
+    """Lê as flags de AES-NI / SHA-NI / AVX2 da CPU (só Linux; vazio nos demais)."""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    return {
+                        "aes_ni": "aes" in flags,
+                        "sha_ni": "sha_ni" in flags,
+                        "avx2": "avx2" in flags,
+                    }
+    except OSError:
+        pass
+    return {}
+
+
+def check_crypto_backend() -> Dict[str, Any]:
+    """
+    Confere o OpenSSL usado pelo Python (TLS de todos os downloads do Drive)
+    e se a CPU tem aceleração de AES/SHA.
+    """
+    started = time.perf_counter()
+    try:
+        flags = _cpu_crypto_flags()
+        details = {
+            "openssl": ssl.OPENSSL_VERSION,
+            "isal": "sim" if isal else "não",
+        }
+        details.update({k: "sim" if v else "não" for k, v in flags.items()})
+
+        if ssl.OPENSSL_VERSION_INFO < (1, 1, 1):
+            status, msg = "warning", f"OpenSSL antigo: {ssl.OPENSSL_VERSION}"
+        elif flags and not flags.get("aes_ni"):
+            status, msg = "warning", "CPU sem AES-NI: TLS dos downloads mais caro."
+        else:
+            status, msg = "ok", ssl.OPENSSL_VERSION
+
+        return {
+            "status": status,
+            "message": msg,
+            "details": details,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+    except Exception as e:
+        return {
+            "status": "warning",
+            "message": str(e),
+            "details": {},
+            "duration_ms": 0.0,
+        }
+
+
+# ==========================================
+# 7. HISTÓRICO DE TAREFAS (FALHAS)
 # ==========================================
 def check_tasks_health() -> Dict[str, Any]:
     started = time.perf_counter()
@@ -317,7 +380,7 @@ def check_tasks_health() -> Dict[str, Any]:
 
 
 # ==========================================
-# 7. MÉTRICAS AVANÇADAS (jobs, falhas, compressão, throughput)
+# 8. MÉTRICAS AVANÇADAS (jobs, falhas, compressão, throughput)
 # ==========================================
 def build_dashboard_metrics() -> Dict[str, Any]:
     """
@@ -455,7 +518,7 @@ def build_dashboard_metrics() -> Dict[str, Any]:
 
 
 # ==========================================
-# 8. FUNÇÃO PRINCIPAL
+# 9. FUNÇÃO PRINCIPAL
 # ==========================================
 def run_health_checks() -> Dict[str, Any]:
     checks = {
@@ -465,6 +528,7 @@ def run_health_checks() -> Dict[str, Any]:
         "google_auth": check_google_auth_db(),
         "disk": check_disk_space(),
         "tasks": check_tasks_health(),
+        "crypto": check_crypto_backend(),
     }
 
     # Status global: Se um for erro = erro. Se um for warning = warning.
@@ -1,13 +1,62 @@
 import threading
-import copy
+from collections import deque
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+from sqlalchemy import update
+
+from config import TASK_HISTORY_MAX_ENTRIES
 from app.models import db, TaskModel
 
-# Cache em memória
+# Cache em memória.
+# Invariante: os valores de cada tarefa são escalares/strings, mais o deque do
+# histórico; listas novas substituem as antigas em vez de serem mutadas.
+# Por isso o snapshot pode ser raso.
 PROGRESS: dict[str, dict] = {}
 
 # LOCK para acesso seguro às threads
 _progress_lock = threading.Lock()
 
+class TaskCancelled(Exception):
+    """
+    Levantada por check_status_pause_cancel quando o usuário cancela a tarefa.
+    Continua sendo Exception para os handlers de topo (status "erro" e limpeza
+    das pastas temporárias) seguirem valendo; quem precisa repassar o
+    cancelamento testa o tipo em vez de procurar "Cancelado" na mensagem.
+    """
+
+    def __init__(self, message: str = "Cancelado pelo usuário"):
+        super().__init__(message)
+
+
+# Eventos de controle por tarefa: (cancelar, rodando).
+# "rodando" limpo = pausado; os workers bloqueiam nele sem polling.
+# Saem do dict quando a tarefa termina (get_task_events recria se preciso).
+_task_events: dict[str, tuple[threading.Event, threading.Event]] = {}
+
+# Fases finais: a tarefa não pausa nem cancela mais
+_FINAL_PHASES = frozenset({"concluido", "erro", "cancelado"})
+
+
+def _new_history(entries=()) -> deque:
+    """
+    O histórico fica em um deque: append O(1) e, se TASK_HISTORY_MAX_ENTRIES
+    estiver configurado, descarte automático das linhas mais antigas.
+    """
+    return deque(entries, maxlen=TASK_HISTORY_MAX_ENTRIES or None)
+
+
+def _snapshot(state: dict) -> dict:
+    """
+    Cópia independente do estado, com o histórico como lista (JSON/DB).
+    Os workers fazem append no histórico sem lock; dict() e list() sobre o
+    deque rodam inteiros em C, então a cópia não quebra com appends concorrentes.
+    Cópia rasa basta: pela invariante acima, nada além do histórico é mutável.
+    """
+    data = dict(state)
+    data["history"] = list(data.get("history", ()))
+    return data
+
 
 def init_download_task(task_id: str) -> dict:
     """
@@ -22,14 +71,14 @@ def init_download_task(task_id: str) -> dict:
         "bytes_found": 0,
         "errors": 0,
         "message": "Iniciando processo...",
-        "history": ["Tarefa criada."],
+        "history": _new_history(["Tarefa criada."]),
         "canceled": False,
         "paused": False,
     }
 
     with _progress_lock:
         PROGRESS[task_id] = initial_state
-        state_copy = copy.deepcopy(PROGRESS[task_id])
+        state_copy = _snapshot(PROGRESS[task_id])
 
     try:
         new_task = TaskModel(
@@ -50,15 +99,18 @@ def init_download_task(task_id: str) -> dict:
 def update_progress(task_id: str, updates: dict):
     """
     Atualiza o progresso em memória.
-    NOTA: Não removemos mais logs antigos (history) conforme solicitado.
+    NOTA: Não removemos mais logs antigos (history) conforme solicitado,
+    a menos que TASK_HISTORY_MAX_ENTRIES seja configurado.
     """
     with _progress_lock:
         if task_id in PROGRESS:
             # Se houver histórico na atualização, fazemos o append
             if "history" in updates:
                 new_logs = updates.pop("history")
-                current_hist = PROGRESS[task_id].get("history", [])
-                # Concatena sem cortar
+                current_hist = PROGRESS[task_id].get("history")
+                if current_hist is None:
+                    current_hist = _new_history()
+                # Concatena (o deque só corta se houver limite configurado)
                 if isinstance(new_logs, list):
                     current_hist.extend(new_logs)
                 else:
@@ -66,6 +118,8 @@ def update_progress(task_id: str, updates: dict):
                 PROGRESS[task_id]["history"] = current_hist
 
             PROGRESS[task_id].update(updates)
+            if updates.get("phase") in _FINAL_PHASES:
+                _task_events.pop(task_id, None)
 
 
 def sync_task_to_db(task_id: str):
@@ -75,34 +129,73 @@ def sync_task_to_db(task_id: str):
     with _progress_lock:
         if task_id not in PROGRESS:
             return
-        data = copy.deepcopy(PROGRESS[task_id])
+        data = _snapshot(PROGRESS[task_id])
+        # Cobre também quem grava a fase final direto no PROGRESS
+        if data.get("phase") in _FINAL_PHASES:
+            _task_events.pop(task_id, None)
 
     try:
-        task = TaskModel.query.get(task_id)
-        if task:
-            task.phase = data.get("phase")
-            task.message = data.get("message")
-            task.files_found = data.get("files_found", 0)
-            task.files_total = data.get("files_total", 0)
-            task.files_downloaded = data.get("files_downloaded", 0)
-            task.bytes_found = data.get("bytes_found", 0)
-            task.errors_count = data.get("errors", 0)
-            task.canceled = data.get("canceled", False)
-            task.paused = data.get("paused", False)
-            task.history = list(data.get("history", []))
-            db.session.commit()
+        # UPDATE direto: sem o SELECT do query.get nem o diff do ORM a cada
+        # sincronização (o periodic_db_sync chama isto a cada poucos segundos)
+        db.session.execute(
+            update(TaskModel)
+            .where(TaskModel.id == task_id)
+            .values(
+                phase=data.get("phase"),
+                message=data.get("message"),
+                files_found=data.get("files_found", 0),
+                files_total=data.get("files_total", 0),
+                files_downloaded=data.get("files_downloaded", 0),
+                bytes_found=data.get("bytes_found", 0),
+                errors_count=data.get("errors", 0),
+                canceled=data.get("canceled", False),
+                paused=data.get("paused", False),
+                history=data["history"],
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
     except Exception as e:
         print(f"Erro ao sincronizar task {task_id}: {e}")
         db.session.rollback()
 
 
+@contextmanager
+def periodic_db_sync(task_id: str | None, interval: float = 2.0):
+    """
+    Enquanto o bloco roda, uma thread grava o progresso no banco a cada
+    `interval` segundos; os workers só mexem no dict em memória.
+    Na saída faz uma última sincronização.
+    """
+    if not task_id or not has_app_context():
+        yield
+        return
+
+    app = current_app._get_current_object()
+    stop = threading.Event()
+
+    def _flush():
+        with app.app_context():
+            while not stop.wait(interval):
+                sync_task_to_db(task_id)
+
+    flusher = threading.Thread(target=_flush, daemon=True)
+    flusher.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        flusher.join()
+        sync_task_to_db(task_id)
+
+
 def get_task_progress(task_id: str) -> dict:
     """
     Lê o progresso (Memória -> DB).
     """
     with _progress_lock:
         if task_id in PROGRESS:
-            return copy.deepcopy(PROGRESS[task_id])
+            return _snapshot(PROGRESS[task_id])
 
     try:
         task = TaskModel.query.get(task_id)
@@ -127,7 +220,7 @@ def get_all_active_tasks():
         # Filtra apenas o básico para a lista
         active = []
         for tid, data in PROGRESS.items():
-            if data.get("phase") not in ["concluido", "erro", "cancelado"]:
+            if data.get("phase") not in _FINAL_PHASES:
                 active.append({
                     "id": tid,
                     "phase": data.get("phase"),
@@ -152,18 +245,50 @@ def _calculate_percent(data):
 
 # --- Controles de Estado ---
 
+def get_task_events(task_id: str) -> tuple[threading.Event, threading.Event]:
+    """
+    Retorna (cancel_event, run_event) da tarefa, criando se preciso a partir
+    das flags atuais. run_event setado = rodando; limpo = pausado.
+    """
+    events = _task_events.get(task_id)
+    if events is not None:
+        return events
+
+    with _progress_lock:
+        events = _task_events.get(task_id)
+        if events is None:
+            cancel_event, run_event = threading.Event(), threading.Event()
+            state = PROGRESS.get(task_id, {})
+            if state.get("canceled"):
+                cancel_event.set()
+            if not state.get("paused"):
+                run_event.set()
+            events = (cancel_event, run_event)
+            _task_events[task_id] = events
+        return events
+
+
 def set_task_pause(task_id: str, paused: bool):
+    cancel_event, run_event = get_task_events(task_id)
     with _progress_lock:
         if task_id in PROGRESS:
             PROGRESS[task_id]["paused"] = paused
             msg = "PAUSADO pelo usuário" if paused else "RESUMIDO pelo usuário"
             PROGRESS[task_id]["history"].append(msg)
             PROGRESS[task_id]["message"] = msg
+    if paused:
+        run_event.clear()
+    else:
+        run_event.set()
     sync_task_to_db(task_id)
 
 def set_task_cancel(task_id: str):
+    cancel_event, run_event = get_task_events(task_id)
     with _progress_lock:
         if task_id in PROGRESS:
             PROGRESS[task_id]["canceled"] = True
             PROGRESS[task_id]["history"].append("Solicitando cancelamento...")
+    cancel_event.set()
+    # Acorda quem estiver pausado para enxergar o cancelamento
+    run_event.set()
     sync_task_to_db(task_id)
\ No newline at end of file
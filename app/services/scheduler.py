@@ -1,14 +1,23 @@
 # services/scheduler_service.py
 import json
+import logging
 import time
 import shutil
 import os
 import pytz
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 from config import TIMEZONE
 
+# orjson (opcional): parse do items_json (seleções grandes) em C
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.cron import CronTrigger
 from app.services.storage import StorageService
 
@@ -17,11 +26,26 @@ from .auth import get_credentials
 from app.services.Google.drive_download import download_items_bundle
 from .progress import PROGRESS, init_download_task
 
+# Filho do logger "gpacker" (structured_logging): usa os handlers dele quando
+# LOG_ENABLED está ligado; a formatação só acontece se o nível estiver ativo
+logger = logging.getLogger("gpacker.scheduler")
+
+# Backups agendados simultâneos: cada um já abre dezenas de conexões com o
+# Drive, então poucos de cada vez (o padrão do APScheduler é 10)
+SCHEDULER_MAX_WORKERS = 3
+
 # Scheduler global
 scheduler = BackgroundScheduler(
-    timezone=pytz.timezone(TIMEZONE)
+    timezone=pytz.timezone(TIMEZONE),
+    executors={"default": ThreadPoolExecutor(max_workers=SCHEDULER_MAX_WORKERS)},
+    job_defaults={
+        # Depois de o app ficar fora do ar, roda uma vez só, não uma por horário perdido
+        "coalesce": True,
+        # O mesmo agendamento nunca roda em paralelo com ele mesmo
+        "max_instances": 1,
+        "misfire_grace_time": 300,
+    },
 )
-STORAGE_ROOT = os.path.join(os.getcwd(), "storage", "backups")
 
 def _render_zip_pattern(pattern: str | None) -> str:
     """
@@ -51,13 +75,15 @@ def _render_zip_pattern(pattern: str | None) -> str:
     return pattern
 
 
+UPCOMING_NOTICE_SECONDS = 120  # aviso 2 minutos antes de cada execução
+
+
 def log_upcoming_jobs():
     """
     Loga no console quando algum agendamento estiver prestes a rodar
-    (por exemplo, dentro dos próximos 2 minutos).
+    (dentro dos próximos UPCOMING_NOTICE_SECONDS) e arma o próximo aviso.
     """
-    now = datetime.now()
-    threshold_seconds = 120  # 2 minutos
+    now = datetime.now(pytz.timezone(TIMEZONE))
 
     for job in scheduler.get_jobs():
         # Ignora o próprio job de monitoramento, se existir
@@ -68,20 +94,55 @@ def log_upcoming_jobs():
         if not next_run:
             continue
 
-        # normaliza para datetime "naive"
-        if getattr(next_run, "tzinfo", None) is not None:
-            next_run_naive = next_run.replace(tzinfo=None)
-        else:
-            next_run_naive = next_run
+        delta = (next_run - now).total_seconds()
 
-        delta = (next_run_naive - now).total_seconds()
-
-        if 0 < delta <= threshold_seconds:
-            print(
-                f"[{now}] Aviso: agendamento ID {job.id} "
-                f"será executado em breve (às {next_run_naive})."
+        if 0 < delta <= UPCOMING_NOTICE_SECONDS:
+            logger.info(
+                "Aviso: agendamento ID %s será executado em breve (às %s).",
+                job.id, next_run.replace(tzinfo=None),
             )
 
+    _arm_upcoming_notice()
+
+
+def _arm_upcoming_notice():
+    """
+    Agenda um único disparo de log_upcoming_jobs para UPCOMING_NOTICE_SECONDS
+    antes da próxima execução, em vez de varrer os jobs a cada minuto.
+    Usa o trigger de cada job (e não next_run_time) para achar o próximo
+    disparo que ainda não foi avisado.
+    """
+    now = datetime.now(pytz.timezone(TIMEZONE))
+    horizon = now + timedelta(seconds=UPCOMING_NOTICE_SECONDS)
+
+    next_fires = []
+    for job in scheduler.get_jobs():
+        if job.id == "upcoming_logger":
+            continue
+        fire = job.trigger.get_next_fire_time(None, horizon)
+        if fire:
+            next_fires.append(fire)
+
+    if not next_fires:
+        if scheduler.get_job("upcoming_logger"):
+            scheduler.remove_job("upcoming_logger")
+        return
+
+    scheduler.add_job(
+        func=log_upcoming_jobs,
+        trigger="date",
+        run_date=min(next_fires) - timedelta(seconds=UPCOMING_NOTICE_SECONDS),
+        id="upcoming_logger",
+        replace_existing=True,
+    )
+
+
+def _load_items_json(raw):
+    """Decodifica o items_json do agendamento (orjson se instalado)."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 
 def job_executor(app_app_context, task_id_db):
     """
@@ -90,11 +151,11 @@ def job_executor(app_app_context, task_id_db):
     """
     with app_app_context():
         start_ts = datetime.now()
-        print(f"[{start_ts}] >>> EXECUTANDO AGENDAMENTO ID {task_id_db}...")
+        logger.info(">>> EXECUTANDO AGENDAMENTO ID %s...", task_id_db)
 
         task = ScheduledTaskModel.query.get(task_id_db)
         if not task or not task.active:
-            print(f"[{datetime.now()}] Tarefa {task_id_db} não encontrada ou inativa. Abortando.")
+            logger.info("Tarefa %s não encontrada ou inativa. Abortando.", task_id_db)
             return
 
         # ---------------------------------------------------------
@@ -103,12 +164,20 @@ def job_executor(app_app_context, task_id_db):
         profile = None
         items = []
         base_zip_name = task.zip_name or "backup_agendado"
+        # Sem perfil: modo concorrente (mapeamento, download e compactação
+        # sobrepostos); com perfil, vale o que o perfil define
+        processing_mode = "concurrent"
+        archive_format = "zip"
+        compression_level = "normal"
 
         if getattr(task, "profile_id", None):
             profile = BackupProfileModel.query.get(task.profile_id)
             if profile:
                 # usa sempre a LISTA ATUAL de itens do perfil
                 items = profile.items or []
+                processing_mode = profile.processing_mode or processing_mode
+                archive_format = profile.archive_format or archive_format
+                compression_level = profile.compression_level or compression_level
 
                 # se o perfil tiver nome específico, prioriza
                 if profile.zip_name:
@@ -119,31 +188,31 @@ def job_executor(app_app_context, task_id_db):
             else:
                 # perfil não encontrado -> fallback para items_json
                 try:
-                    items = json.loads(task.items_json)
+                    items = _load_items_json(task.items_json)
                 except Exception:
                     items = []
         else:
             try:
-                items = json.loads(task.items_json)
+                items = _load_items_json(task.items_json)
             except Exception:
                 items = []
 
         if not items:
             msg = "Nenhum item configurado para este agendamento."
-            print(f"[{datetime.now()}] {msg}")
+            logger.info(msg)
             task.last_status = msg
             task.last_run_at = datetime.now()
             db.session.commit()
             return
 
-        print(
-            f"[{datetime.now()}] Tarefa '{task.name}' "
-            f"(freq={task.frequency}, hora={task.run_time}) iniciada."
+        logger.info(
+            "Tarefa '%s' (freq=%s, hora=%s) iniciada.",
+            task.name, task.frequency, task.run_time,
         )
 
         creds = get_credentials()
         if not creds:
-            print(f"[{datetime.now()}] ERRO: Credenciais inválidas ou expiradas.")
+            logger.error("ERRO: Credenciais inválidas ou expiradas.")
             task.last_status = "Erro: Credenciais expiradas"
             task.last_run_at = datetime.now()
             db.session.commit()
@@ -165,35 +234,34 @@ def job_executor(app_app_context, task_id_db):
             date_str = datetime.now().strftime("%Y%m%d_%H%M")
             final_zip_name = f"{base_zip_name}_{date_str}"
 
-            print(
-                f"[{datetime.now()}] Iniciando mapeamento + download "
-                f"para {len(items)} item(ns). Nome base: {final_zip_name}"
+            logger.info(
+                "Iniciando mapeamento + download para %d item(ns). Nome base: %s",
+                len(items), final_zip_name,
             )
 
-            # Modo 'sequential' fixo, como antes
             zip_path = download_items_bundle(
                 creds=creds,
                 items=items,
                 base_name=final_zip_name,
-                compression_level="normal",
-                archive_format="zip",
+                compression_level=compression_level,
+                archive_format=archive_format,
                 progress_dict=PROGRESS,
                 task_id=run_id,
-                processing_mode="sequential",
+                processing_mode=processing_mode,
             )
 
-            print(f"[{datetime.now()}] Download concluído. Zip temporário em: {zip_path}")
-
-            if not os.path.exists(STORAGE_ROOT):
-                StorageService.ensure_dir(STORAGE_ROOT)
+            logger.info("Download concluído. Zip temporário em: %s", zip_path)
 
+            # Mesma pasta de backups da UI; com o temp_work no mesmo storage,
+            # o move é só um rename, sem recopiar o pacote
+            storage_root = StorageService.backups_dir(ensure=False)
             filename = os.path.basename(zip_path)
-            final_dest = os.path.join(STORAGE_ROOT, filename)
+            final_dest = os.path.join(storage_root, filename)
+            # Tamanho lido no temp_work (disco local), não no destino, que
+            # pode ser um storage de rede
+            size_mb = round(os.path.getsize(zip_path) / (1024 * 1024), 2)
             shutil.move(zip_path, final_dest)
 
-            stat = os.stat(final_dest)
-            size_mb = round(stat.st_size / (1024 * 1024), 2)
-
             bf = BackupFileModel(
                 filename=filename,
                 path=final_dest,
@@ -212,14 +280,14 @@ def job_executor(app_app_context, task_id_db):
             run_record.size_mb = size_mb
             run_record.filename = filename
 
-            print(
-                f"[{datetime.now()}] <<< AGENDAMENTO ID {task.id} finalizado com sucesso. "
-                f"Arquivo: {filename} ({size_mb} MB)"
+            logger.info(
+                "<<< AGENDAMENTO ID %s finalizado com sucesso. Arquivo: %s (%s MB)",
+                task.id, filename, size_mb,
             )
 
         except Exception as e:
             err = str(e)
-            print(f"[{datetime.now()}] ERRO no agendamento ID {task.id}: {err}")
+            logger.error("ERRO no agendamento ID %s: %s", task.id, err)
             task.last_status = f"Erro: {err[:100]}"
             task.last_run_at = datetime.now()
 
@@ -234,24 +302,63 @@ def init_scheduler(app):
     Inicializa o scheduler e carrega as tarefas do banco.
     Deve ser chamado no startup do Flask.
     """
+    # Pasta de destino dos backups garantida uma vez aqui, não a cada execução
+    with app.app_context():
+        StorageService.backups_dir()
+
     if not scheduler.running:
         scheduler.start()
-        print("[Scheduler] BackgroundScheduler iniciado.")
+        logger.info("BackgroundScheduler iniciado.")
 
     reload_jobs(app)
 
 
+@lru_cache(maxsize=None)
+def _build_trigger(frequency: str, hour: int, minute: int):
+    """
+    CronTrigger da frequência/horário (None se a frequência for inválida).
+    Os triggers não mudam depois de criados, então agendamentos com o mesmo
+    horário compartilham a mesma instância.
+    """
+    tz = pytz.timezone(TIMEZONE)
+
+    if frequency == "daily":
+        return CronTrigger(hour=hour, minute=minute, timezone=tz)
+
+    if frequency == "weekly":
+        # ex: toda segunda-feira (ajuste se quiser outro dia)
+        return CronTrigger(day_of_week="mon", hour=hour, minute=minute, timezone=tz)
+
+    if frequency == "monthly":
+        return CronTrigger(day=1, hour=hour, minute=minute, timezone=tz)
+
+    return None
+
+
 def reload_jobs(app):
     """
-    Limpa todos os jobs e recarrega do banco de dados.
+    Sincroniza os jobs com o banco de dados: adiciona/atualiza só o que mudou
+    e remove os agendamentos que deixaram de existir ou de estar ativos.
     Chamado ao iniciar o app ou ao criar/editar tarefas.
     """
-    print("[Scheduler] Recarregando jobs agendados...")
-    scheduler.remove_all_jobs()
+    logger.info("Recarregando jobs agendados...")
+    existing = {job.id: job for job in scheduler.get_jobs() if job.id != "upcoming_logger"}
+    desired = set()
 
     with app.app_context():
-        tasks = ScheduledTaskModel.query.filter_by(active=True).all()
-        print(f"[Scheduler] Encontradas {len(tasks)} tarefas ativas para agendar.")
+        # Só as colunas usadas para montar os triggers (sem items_json etc.)
+        tasks = (
+            ScheduledTaskModel.query
+            .with_entities(
+                ScheduledTaskModel.id,
+                ScheduledTaskModel.name,
+                ScheduledTaskModel.run_time,
+                ScheduledTaskModel.frequency,
+            )
+            .filter_by(active=True)
+            .all()
+        )
+        logger.info("Encontradas %d tarefas ativas para agendar.", len(tasks))
 
         for task in tasks:
             try:
@@ -259,38 +366,33 @@ def reload_jobs(app):
             except Exception:
                 hour, minute = 0, 0
 
-            trigger = None
-
-            if task.frequency == "daily":
-                trigger = CronTrigger(hour=hour, minute=minute, timezone=pytz.timezone(TIMEZONE))
-
-            elif task.frequency == "weekly":
-                # ex: toda segunda-feira (ajuste se quiser outro dia)
-                trigger = CronTrigger(day_of_week="mon", hour=hour, minute=minute, timezone=pytz.timezone(TIMEZONE))
-
-            elif task.frequency == "monthly":
-                trigger = CronTrigger(day=1, hour=hour, minute=minute, timezone=pytz.timezone(TIMEZONE))
+            trigger = _build_trigger(task.frequency, hour, minute)
 
             if trigger:
+                job_id = str(task.id)
+                desired.add(job_id)
+                current = existing.get(job_id)
+                if current is not None and str(current.trigger) == str(trigger):
+                    # Mesmo horário: mantém o job como está
+                    continue
+
                 scheduler.add_job(
                     func=job_executor,
                     trigger=trigger,
                     args=[app.app_context, task.id],
-                    id=str(task.id),
+                    id=job_id,
                     replace_existing=True,
                 )
-                print(
-                    f"[Scheduler] -> Job '{task.name}' (id={task.id}) agendado: "
-                    f"{task.frequency} às {task.run_time}"
+                logger.info(
+                    "-> Job '%s' (id=%s) agendado: %s às %s",
+                    task.name, task.id, task.frequency, task.run_time,
                 )
 
-    # Job auxiliar que roda a cada 60s para avisar quando existir
-    # agendamento próximo da hora de execução.
-    scheduler.add_job(
-        func=log_upcoming_jobs,
-        trigger="interval",
-        seconds=60,
-        id="upcoming_logger",
-        replace_existing=True,
-    )
-    print("[Scheduler] Job de monitoramento de agendamentos futuros registrado (a cada 60s).")
+    # Desativados, excluídos ou com frequência inválida
+    for job_id in existing.keys() - desired:
+        scheduler.remove_job(job_id)
+        logger.info("-> Job id=%s removido.", job_id)
+
+    # Aviso no console antes da próxima execução (um disparo só, rearmado a cada aviso)
+    _arm_upcoming_notice()
+    logger.info("Aviso de agendamentos futuros armado.")
@@ -1,5 +1,6 @@
 import os
 import time
+import threading
 from typing import Optional
 
 try:
@@ -20,6 +21,8 @@ class StorageService:
     - Garante criação de diretórios de forma robusta e thread-safe
     """
 
+    _known_dirs_lock = threading.Lock()
+
     # ---------------------------------------------------------
     # Helpers internos
     # ---------------------------------------------------------
@@ -145,6 +148,38 @@ class StorageService:
                             raise
         return path
 
+    @classmethod
+    def ensure_dir_cached(cls, path: str, known_dirs: set) -> str:
+        """
+        Variante de ensure_dir para laços quentes (um arquivo por iteração).
+        known_dirs é um set criado por job: diretórios já garantidos não
+        passam de novo pelo makedirs (um lstat por componente do caminho).
+        """
+        if path in known_dirs:
+            return path
+        with cls._known_dirs_lock:
+            if path not in known_dirs:
+                cls.ensure_dir(path)
+                known_dirs.add(path)
+        return path
+
+    @classmethod
+    def ensure_dirs(cls, paths, known_dirs: set) -> None:
+        """
+        Cria de uma vez um conjunto de diretórios (ex.: todas as pastas de um
+        job antes dos downloads). Só as folhas passam pelo makedirs, que já
+        cria os pais; tudo entra em known_dirs para o ensure_dir_cached pular.
+        """
+        pending = sorted(set(paths) - known_dirs, reverse=True)
+        created_prefix = None
+        for path in pending:
+            # Em ordem reversa, um pai vem logo depois de algum filho já criado
+            if created_prefix and created_prefix.startswith(path + os.sep):
+                continue
+            cls.ensure_dir(path)
+            created_prefix = path
+        known_dirs.update(pending)
+
     @classmethod
     def ensure_parent_dir(cls, file_path: str) -> None:
         """
@@ -71,6 +71,18 @@ BACKUP_RETENTION_MAX_FILES = 12  # exemplo: 10
 # Quantidade máxima de dias a manter (0 ou None = ilimitado)
 BACKUP_RETENTION_MAX_DAYS = 30   # exemplo: 30
 
+# Máximo de linhas de histórico mantidas por tarefa em memória
+# (0 ou None = ilimitado, comportamento padrão)
+TASK_HISTORY_MAX_ENTRIES = None
+
+# Conexões simultâneas de download com o Drive (limitadas pela cota QPS
+# por usuário da API). Pode ser ajustado pela variável GPACKER_DL_WORKERS.
+DOWNLOAD_MAX_WORKERS = int(os.environ.get("GPACKER_DL_WORKERS", "150"))
+
+# Conexões simultâneas do mapeamento (files.list por lote de pastas).
+# Pode ser ajustado pela variável GPACKER_MAP_WORKERS.
+MAPPING_MAX_WORKERS = int(os.environ.get("GPACKER_MAP_WORKERS", "150"))
+
 LOG_ENABLED = False  # False = desativa totalmente os logs
 LOG_EXTERNAL_ENABLED = False  # envia logs para endpoint externo
 LOG_EXTERNAL_URL = "http://meu-servico-de-logs/api/events"
\ No newline at end of file